@@ -1,46 +1,191 @@
 import chess_game
+import bitboard
+import transposition
+import book
+import evaluation
+import engine_pool
+import eval_cache
+import ordering
+import parallel
+import profiling
+import search_stats
+import smp
+import itertools
 import math
-import copy
-import os
-import csv
+import random
 import time
-import chess
-import chess.engine
 import numpy as np
 
-engine = chess.engine.SimpleEngine.popen_uci("stockfish-windows-x86-64-avx2.exe")
+# Deepest iteration of a search limited only by its time or node budget
+MAX_DEPTH = 64
+# Captures that cannot lift the static score within this much of the bound are skipped
+DELTA_MARGIN = 200
 
 class ChessAI():
         
-        def __init__(self, color, chess_game, max_depth=3):
+        def __init__(self, color, chess_game, max_depth=3, tt_size=1 << 20, book_path='openings.bin', evaluator='stockfish',
+                     engine_path=engine_pool.DEFAULT_ENGINE, engines=None, engine_time=.1, engine_nodes=None,
+                     eval_cache_bytes=16 << 20, quiescence=None, quiescence_checks=False, workers=None,
+                     smp_workers=None, stats_sink=None, compile_book=True):
             self.color = color
             self.max_depth = max_depth
             self.game = chess_game
             self.piece_values = {'P': 100, 'H': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000}
             self.alphabet = 'abcdefgh'
-
-
-
-        def evaluate_board(self, board, color, time_limit=.1):
-            # Convert the board into FEN notation
-            fen_board = self.board_to_FEN(board, color, True)
-            
-            # Create a chess.Board object from the FEN notation
-            eval_board = chess.Board(fen_board)
-
-            # Analyze the board position with Stockfish
-            result = engine.analyse(eval_board, chess.engine.Limit(time=time_limit))
-            score = result["score"].white().score() if color == "white" else result["score"].black().score()
-
+            # Transposition table, scores are from tt_color's point of view
+            # With smp_workers it lives in shared memory for the helper processes
+            if smp_workers is not None and smp_workers > 1:
+                self.tt = transposition.SharedTranspositionTable(tt_size)
+            else:
+                self.tt = transposition.TranspositionTable(tt_size)
+            self.tt_color = color
+            # Compiled opening book, None if there are no openings
+            # It is compiled here when missing, worker processes only open the parent's
+            self.book = book.open_book(book_path, compile=compile_book)
+            # Leaf evaluator, 'stockfish' asks the engine, 'native' uses the piece-square tables
+            self.evaluator = evaluator
+            self.native_evaluator = evaluation.Evaluator()
+            # Stockfish processes, started when first needed
+            # engines is the pool size (default one per core), engine_time and engine_nodes limit each analysis
+            self.engine_pool = engine_pool.EnginePool(engine_path, engines)
+            self.engine_time = engine_time
+            self.engine_nodes = engine_nodes
+            # Engine scores kept across searches, keyed by position, color and limit
+            self.eval_cache = eval_cache.EvalCache(eval_cache_bytes)
+            # Scores of the current batch of leaves analysed by prefetch_leaves, with the time each took
+            self.prefetched = {}
+            # Resolve captures at the leaves (and checks right after them) before evaluating
+            # On by default only for the native evaluator, with the engine every stand-pat would be an engine call
+            if quiescence is None:
+                quiescence = evaluator == 'native'
+            self.quiescence = quiescence
+            self.quiescence_checks = quiescence_checks
+            # Killer and history tables, cleared for every search
+            self.ordering = ordering.MoveOrdering(MAX_DEPTH + 1)
+            # Processes that search the root moves in parallel, started on the first search
+            # Each worker builds its own ChessAI from these settings, with one engine each
+            self.workers = workers
+            self.root_pool = None
+            self.worker_options = {
+                'tt_size': tt_size,
+                'book_path': book_path,
+                'compile_book': False,
+                'evaluator': evaluator,
+                'engine_path': engine_path,
+                'engines': 1,
+                'engine_time': engine_time,
+                'engine_nodes': engine_nodes,
+                'eval_cache_bytes': eval_cache_bytes,
+                'quiescence': quiescence,
+                'quiescence_checks': quiescence_checks
+            }
+            if workers is not None and smp_workers is not None:
+                raise ValueError("Use either root-parallel workers or smp_workers, not both")
+            # Lazy SMP helper processes, which share the transposition table
+            self.smp_pool = None
+            if smp_workers is not None and smp_workers > 1:
+                self.smp_pool = smp.SmpPool(smp_workers - 1, self.tt, self.worker_options)
+            self.helper_nodes = 0
+            # Set by a Lazy SMP helper, stops its search when the main search is done
+            self.stop_flag = None
+            # Set by a root-parallel worker, the best root score of every worker so far
+            self.shared_alpha = None
+            # Statistics of the last search, written as a JSON line to stats_sink when one is given
+            # stats_sink is a file path, an open stream, '-' for standard error, or has an emit method
+            self.stats = search_stats.SearchStats()
+            self.stats_sink = search_stats.make_sink(stats_sink)
+            # A sink made here is closed by close(), one passed in belongs to the caller
+            self.owns_stats_sink = self.stats_sink is not stats_sink
+            # Last completed iteration of the running search: depth, move, score and nodes
+            self.progress = None
+
+
+
+        def evaluate_board(self, board, color, time_limit=None):
+            stats = self.stats
+            stats.leaf_evals += 1
+            tic = time.perf_counter()
+            # The native evaluator is incremental, cheaper than a cache lookup
+            if self.evaluator == 'native':
+                score = self.native_evaluator.evaluate(board, color)
+                stats.eval_time += time.perf_counter() - tic
+                return score
+
+            if time_limit is None:
+                time_limit = self.engine_time
+            limit = (time_limit, self.engine_nodes)
+            score = self.eval_cache.get(board.key, color, limit)
+            if score is not None:
+                stats.eval_time += time.perf_counter() - tic
+                return score
+
+            prefetched = self.prefetched.pop((board.key, color, limit), None)
+            if prefetched is not None:
+                # Analysed with the rest of its batch by prefetch_leaves
+                score, engine_time = prefetched
+            else:
+                # Convert the board into FEN notation
+                fen_board = self.board_to_FEN(board, color, True)
+
+                # Analyze the board position with Stockfish
+                engine_tic = time.perf_counter()
+                score = self.engine_pool.analyse(fen_board, color, time=time_limit, nodes=self.engine_nodes)
+                engine_time = time.perf_counter() - engine_tic
+            stats.engine_calls += 1
+            stats.engine_time += engine_time
+            stats.eval_time += time.perf_counter() - tic + (engine_time if prefetched is not None else 0.0)
+            self.eval_cache.put(board.key, color, limit, score)
             return score
 
-        def switch_coordinates(self, piece):
-            row, col = piece.position
-            row += 7 - 2 * row
-            return (row, col)
-        
+        def prefetch_moves(self, board, moves):
+            """
+            Yield moves in order, analysing the leaves below them on the engine pool a batch at a time
+            A batch is as large as the pool, and the next one is only sent when the search asks for
+            a move past the last, so moves cut off by alpha-beta are never analysed
+            """
+
+            moves = iter(moves)
+            while True:
+                batch = list(itertools.islice(moves, self.engine_pool.size))
+                if not batch:
+                    return
+                self.prefetch_leaves(board, batch)
+                yield from batch
+
+        def prefetch_leaves(self, board, moves):
+            """
+            Evaluate the leaves below moves of a node just above them concurrently on the engine pool
+            The scores are kept in self.prefetched until evaluate_board reaches their leaf, and
+            only leaves that get evaluated count as engine calls
+            """
+
+            limit = (self.engine_time, self.engine_nodes)
+            keys = []
+            fens = []
+            for move in moves:
+                board.make_move(move)
+                # Illegal moves, table hits and finished games never reach evaluate_board
+                if (not board.is_check(board.turn ^ 1) and self.tt.probe(board.key) is None
+                        and not self.eval_cache.contains(board.key, self.tt_color, limit)
+                        and self.game.game_status(board).result is None):
+                    keys.append(board.key)
+                    fens.append(self.board_to_FEN(board, board.turn, True))
+                board.unmake_move()
+
+            self.prefetched = {}
+            if not fens:
+                return
+            tic = time.perf_counter()
+            scores = self.engine_pool.analyse_many(fens, self.tt_color, time=self.engine_time, nodes=self.engine_nodes)
+            # The batch ran concurrently, each leaf is charged its share of the wall time
+            seconds = (time.perf_counter() - tic) / len(fens)
+            for key, score in zip(keys, scores):
+                self.prefetched[(key, self.tt_color, limit)] = (score, seconds)
 
         def get_game_phase(self, board):
+            if isinstance(board, bitboard.Position):
+                return 'early' if board.piece_count() > 12 else 'late'
+
             piece_count = 0
             for piece in board.values():
                 if piece is not None:
@@ -51,206 +196,517 @@ class ChessAI():
             return 'late'
         
 
-        def get_best_move(self, board, color, depth):
+        def get_best_move(self, board, color, depth=None, time_limit=None, node_limit=None, with_stats=False,
+                          profile=None, profile_path='search', profile_interval=profiling.SAMPLE_INTERVAL):
+            """
+            Iterative deepening search, one iteration per depth up to depth (max_depth by default)
+            time_limit in seconds or node_limit stop the search once they run out, and the best
+            move of the last completed iteration is played, or if the first iteration did not finish,
+            the best root move it did search. Each iteration searches the previous best line first.
+            Returns None if there is no legal move.
+            The search's SearchStats is kept as self.stats, and with_stats returns (move, stats).
+            profile runs the search under the 'cprofile' or 'sample' profiler, which writes
+            profile_path + '.pstats' and '.collapsed' (see the profiling module).
+            """
+
+            if profile is not None:
+                return profiling.profile_call(self.get_best_move, (board, color, depth, time_limit, node_limit, with_stats),
+                                              mode=profile, path=profile_path, interval=profile_interval)
+
             tic1 = time.perf_counter()
+            budget = time_limit is not None or node_limit is not None
+            if depth is None:
+                depth = MAX_DEPTH if budget else self.max_depth
             self.depth = depth
-            folder_path = 'openings'
-            files = os.listdir(folder_path)
-            fen_board = self.board_to_FEN(board, color)
-            
-            for file in files:
-                with open(os.path.join(folder_path, file)) as f:
-                    tsv_reader = csv.DictReader(f, delimiter="\t")
-                    for row in tsv_reader:
-                        if row['fen'] == fen_board:
-                            move_string = row['best_move']
-                            move = eval(move_string)
-                            return move
-            
-            move = self.minimax(board, color)
-            toc1 = time.perf_counter()
-            print(f"1 move minimax time: {toc1 - tic1:0.4f} seconds")
+            # Search on a bitboard copy of the game instead of the board dictionary
+            position = bitboard.Position.from_board(board, color, self.game.last_move, self.game.halfmove, self.game.fullmove,
+                                                    self.game.key_history, self.game.castling)
+
+            # Play from the opening book when the position is in it
+            if self.book is not None:
+                move = self.book.lookup(position)
+                if move is not None:
+                    self.stats = search_stats.SearchStats()
+                    self.stats.source = 'book'
+                    return self.report(position, move, tic1, with_stats)
+
+            moves = self.get_legal_moves(position, color)
+            if not moves:
+                self.stats = search_stats.SearchStats()
+                self.stats.source = 'game over'
+                return self.report(position, None, tic1, with_stats)
+            if len(moves) == 1:
+                self.stats = search_stats.SearchStats()
+                self.stats.source = 'forced'
+                return self.report(position, moves[0], tic1, with_stats)
+
+            # Lazy SMP helpers search the same position and fill the shared table meanwhile
+            if self.smp_pool is not None:
+                if color != self.tt_color:
+                    self.tt.clear()
+                    self.tt_color = color
+                self.smp_pool.start(position, color, depth, time_limit)
+            try:
+                move = self.search(position, color, depth, time_limit, node_limit)
+            finally:
+                if self.smp_pool is not None:
+                    self.helper_nodes = self.smp_pool.stop()
+
+            if self.smp_pool is not None:
+                self.stats.helper_nodes = self.helper_nodes
+            return self.report(position, move, tic1, with_stats)
+
+        def report(self, position, move, tic, with_stats=False):
+            # Finish the search's statistics, write them to the sink and return the move as a list
+            self.stats.move = move
+            self.stats.time = time.perf_counter() - tic
+            if self.stats_sink is not None:
+                self.stats_sink.emit(self.stats.to_dict())
+            # No legal move, or stopped through stop_flag before the first iteration was done
+            move = None if move is None else position.move_to_list(move)
+            return (move, self.stats) if with_stats else move
+
+
+        def search(self, position, color, depth, time_limit=None, node_limit=None, start_depth=0):
+            """
+            Iterative deepening on a Position from start_depth up to depth, returns the packed best move
+            of the last completed iteration, None without a legal move. The budget applies from the
+            start, and a first iteration it stops plays its best finished root move, or the first root
+            move in order when none finished. Statistics go in a new self.stats.
+            """
+
+            tic1 = time.perf_counter()
+            budget = time_limit is not None or node_limit is not None
+            self.stats = stats = search_stats.SearchStats()
+            self.prefetched = {}
+            cache_hits, cache_misses = self.eval_cache.hits, self.eval_cache.misses
+            self.nodes = 0
+            self.stopped = False
+            self.ordering.clear()
+            self.deadline = None if time_limit is None else tic1 + time_limit
+            self.node_limit = node_limit
+            self.root_moves = []
+            max_depth = self.max_depth
+            move = None
+            root_scores = {}
+            try:
+                for iteration in range(start_depth, depth + 1):
+                    self.max_depth = iteration
+                    tic = time.perf_counter()
+                    nodes = self.nodes
+                    scores = self.minimax(position, color, root_scores)
+                    if self.stopped and move is None and self.root_moves:
+                        # Out of budget in the first iteration, the root moves it finished are all there is
+                        move = self.best_root_score(scores)['move'] if scores else self.root_moves[0]
+                    # Stopped, or the game is over and there is nothing to search
+                    if self.stopped or not scores:
+                        break
+                    root_scores = {x['move']: x['score'] for x in scores}
+                    best = self.best_root_score(scores)
+                    move = best['move']
+                    toc = time.perf_counter()
+                    self.progress = {'depth': iteration + 1, 'move': position.move_to_list(move), 'score': best['score'], 'nodes': self.nodes}
+                    stats.depth = iteration + 1
+                    stats.score = best['score']
+                    stats.iterations.append({'depth': iteration + 1, 'move': move, 'score': best['score'], 'nodes': self.nodes - nodes, 'time': toc - tic})
+
+                    # A forced win cannot get any better with more depth
+                    if best['score'] == math.inf:
+                        break
+                    if budget and self.out_of_budget():
+                        break
+            finally:
+                self.max_depth = max_depth
+                stats.move = move
+                stats.nodes = self.nodes
+                stats.time = time.perf_counter() - tic1
+                stats.eval_cache_hits = self.eval_cache.hits - cache_hits
+                stats.eval_cache_misses = self.eval_cache.misses - cache_misses
 
             return move
 
 
-        def minimax(self, board, color):
+        def best_root_score(self, scores):
+            # The first highest score, where a root-parallel score that raised alpha beats a fail-low tie
+            return max(scores, key=lambda x: (x['score'], x.get('exact', True)))
+
+        def minimax(self, board, color, root_scores=None):
+            """
+            Search every root move to max_depth and return a list of {'move', 'score', 'time', 'nodes'}
+            root_scores from the previous iteration orders the moves, best first
+            """
+
             alpha = -math.inf
             beta = math.inf
             scores = []
 
-            for move in self.get_legal_moves(board, color):
+            # Every score in the search is from color's point of view
+            if color != self.tt_color:
+                self.tt.clear()
+                self.tt_color = color
+
+            moves = self.get_legal_moves(board, color)
+            if root_scores:
+                moves.sort(key=lambda move: root_scores.get(move, -math.inf), reverse=True)
+            elif self.ordering.seed is not None:
+                # A Lazy SMP helper starts from its own order of the root moves
+                random.Random(self.ordering.seed).shuffle(moves)
+            self.root_moves = moves
+
+            if self.workers is not None and self.workers > 1 and len(moves) > 1:
+                return self.parallel_minimax(board, color, moves)
+
+            # When the root's children are the leaves, analyse them a pool-sized batch at a time too
+            if self.evaluator == 'stockfish' and self.max_depth == 0 and self.engine_pool.size > 1:
+                moves = self.prefetch_moves(board, moves)
+
+            for move in moves:
                 tic = time.perf_counter()
-                temp_board = copy.deepcopy(board)
-                opp_color = 'white' if color == 'black' else 'black'
-                score = self.maxValue(self.game.make_move(move, temp_board), opp_color, 0, alpha, beta)
+                nodes = self.nodes
+                score = self.search_root_move(board, color, move, alpha, beta)
+                if self.stopped:
+                    break
                 dict = {
                     'move': move, 
-                    'score': score
+                    'score': score,
+                    'time': time.perf_counter() - tic,
+                    'nodes': self.nodes - nodes
                 }
                 scores.append(dict)
 
                 alpha = max(alpha, score)
-                toc = time.perf_counter()
-                print(f"1 move minimax time: {toc - tic:0.4f} seconds")
 
-            best_action = max(scores, key=lambda x: x['score'])['move']
-            return best_action
-            
+            return scores
+
+        def search_root_move(self, board, color, move, alpha, beta):
+            # Search the move in place and take it back afterwards
+            board.make_move(move)
+            opp_color = 'white' if color == 'black' else 'black'
+            score = self.minValue(board, opp_color, 0, alpha, beta)
+            board.unmake_move()
+            return score
+
+        def parallel_minimax(self, board, color, moves):
+            """
+            Search the root moves on the worker processes
+            Returns the same list as minimax, with the time and nodes each move took
+            and whether its score is exact
+            """
+
+            if self.root_pool is None:
+                self.root_pool = parallel.RootSearchPool(self.workers, self.worker_options)
+
+            time_limit = None if self.deadline is None else max(self.deadline - time.perf_counter(), 0)
+            node_limit = None if self.node_limit is None else max(self.node_limit - self.nodes, 1)
+            results = self.root_pool.search(board, color, moves, self.max_depth, time_limit, node_limit)
+
+            scores = []
+            for result in results:
+                self.nodes += result['nodes']
+                self.stats.merge(result['stats'])
+                # A move that ran out of budget has no score
+                if result['stopped']:
+                    self.stopped = True
+                    continue
+                scores.append({key: result[key] for key in ('move', 'score', 'exact', 'time', 'nodes')})
+            return scores
+
+        def close(self):
+            # Stop the worker processes and engines, and close a stats sink made from a path or stream
+            if self.root_pool is not None:
+                self.root_pool.close()
+                self.root_pool = None
+            if self.smp_pool is not None:
+                self.smp_pool.close()
+                self.smp_pool = None
+                self.tt.close()
+            self.engine_pool.close()
+            if self.owns_stats_sink and self.stats_sink is not None:
+                self.stats_sink.close()
+                self.stats_sink = None
+
+        def out_of_budget(self):
+            # Count a node and stop the search when the time or node budget is spent
+            self.nodes += 1
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                self.stopped = True
+            elif self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.stopped = True
+            elif self.stop_flag is not None and self.stop_flag.value:
+                self.stopped = True
+            return self.stopped
+
+        def hash_move(self, board):
+            # The stored best move goes first, after an iteration that is the previous best line
+            entry = self.tt.probe(board.key)
+            return entry[4] if entry is not None else None
+
             
         def minValue(self, board, color, depth, alpha, beta):
+            # color is the opponent, scores are from opp_color's point of view
             opp_color = 'white' if color == 'black' else 'black'
 
-            if self.game.is_checkmate() or self.game.is_stalemate() or depth == self.max_depth:
-                return self.evaluate_board(board, color)
+            if self.out_of_budget():
+                return 0
 
-            v = math.inf
-            for move in self.get_legal_moves(board, color):
-                temp_board = copy.deepcopy(board)
-                new_board = self.game.make_move(move, temp_board)
-                if new_board is not None:
-                    try:
-                        v = min(v, self.maxValue(new_board, opp_color, depth + 1, alpha, beta))
-                    except:
-                        v = v
+            score = self.probe_table(board, depth, alpha, beta)
+            if score is not None:
+                return score
 
-                    beta = min(beta, v)
+            # A finished game scores as mate for the side giving it, or 0 for a draw
+            status = self.game.game_status(board)
+            if status.result is not None:
+                return math.inf if status.result == chess_game.CHECKMATE else 0
+
+            if depth == self.max_depth:
+                if self.quiescence:
+                    return self.quiescence_leaf(board, depth, alpha, beta)
+                self.stats.max_depth = max(self.stats.max_depth, depth + 1)
+                score = self.evaluate_board(board, opp_color)
+                self.tt.store(board.key, 0, transposition.EXACT, score, None)
+                return score
+
+            alpha_start, beta_start = alpha, beta
+            best_move = None
+            v = math.inf
+            stats = self.stats
+            stats.expanded_nodes += 1
+            # Moves are generated a stage at a time, so a cutoff skips the later stages
+            moves = self.ordering.staged_moves(board, self.hash_move(board), depth)
+            # Engine leaves are slow, so analyse them a pool-sized batch at a time
+            if self.evaluator == 'stockfish' and depth + 1 == self.max_depth and self.engine_pool.size > 1:
+                moves = self.prefetch_moves(board, moves)
+
+            # Time from asking the generator for a move until the move is known to be legal
+            index = 0
+            tic = time.perf_counter()
+            for move in moves:
+                if depth == 0 and self.shared_alpha is not None:
+                    # Root moves finished on other workers may have raised alpha since the last reply
+                    alpha = alpha_start = max(alpha, self.shared_alpha.value)
                     if beta <= alpha:
                         break
+                board.make_move(move)
+                # Legality is only checked for moves that get searched
+                if board.is_check(board.turn ^ 1):
+                    board.unmake_move()
+                    continue
+                stats.movegen_time += time.perf_counter() - tic
+                stats.moves_searched += 1
+                score = self.maxValue(board, opp_color, depth + 1, alpha, beta)
+                board.unmake_move()
+                if score < v:
+                    v = score
+                    best_move = move
+                if self.stopped:
+                    return v
+
+                beta = min(beta, v)
+                if beta <= alpha:
+                    stats.add_cutoff(index)
+                    self.ordering.update(board, move, depth, self.max_depth - depth)
+                    break
+                index += 1
+                tic = time.perf_counter()
 
+            self.store_table(board, depth, v, alpha_start, beta_start, best_move)
             return v
 
         def maxValue(self, board, color, depth, alpha, beta):
             opp_color = 'white' if color == 'black' else 'black'
 
-            if self.game.is_checkmate() or self.game.is_stalemate() or depth == self.max_depth:
-                return self.evaluate_board(board, color)
+            if self.out_of_budget():
+                return 0
 
-            v = -math.inf
-            for move in self.get_legal_moves(board, color):
-                temp_board = copy.deepcopy(board)
-                new_board = self.game.make_move(move, temp_board)
-                if new_board is not None:
-                    try:
-                        v = max(v, self.minValue(new_board, opp_color, depth + 1, alpha, beta))
-                    except:
-                        v = v
+            score = self.probe_table(board, depth, alpha, beta)
+            if score is not None:
+                return score
 
-                    alpha = max(alpha, v)
-                    if alpha >= beta:
-                        break
+            # A finished game scores as mate for the side giving it, or 0 for a draw
+            status = self.game.game_status(board)
+            if status.result is not None:
+                return -math.inf if status.result == chess_game.CHECKMATE else 0
+
+            if depth == self.max_depth:
+                if self.quiescence:
+                    return self.quiescence_leaf(board, depth, alpha, beta)
+                self.stats.max_depth = max(self.stats.max_depth, depth + 1)
+                score = self.evaluate_board(board, color)
+                self.tt.store(board.key, 0, transposition.EXACT, score, None)
+                return score
+
+            alpha_start, beta_start = alpha, beta
+            best_move = None
+            v = -math.inf
+            stats = self.stats
+            stats.expanded_nodes += 1
+            # Moves are generated a stage at a time, so a cutoff skips the later stages
+            moves = self.ordering.staged_moves(board, self.hash_move(board), depth)
+            # Engine leaves are slow, so analyse them a pool-sized batch at a time
+            if self.evaluator == 'stockfish' and depth + 1 == self.max_depth and self.engine_pool.size > 1:
+                moves = self.prefetch_moves(board, moves)
+
+            # Time from asking the generator for a move until the move is known to be legal
+            index = 0
+            tic = time.perf_counter()
+            for move in moves:
+                board.make_move(move)
+                # Legality is only checked for moves that get searched
+                if board.is_check(board.turn ^ 1):
+                    board.unmake_move()
+                    continue
+                stats.movegen_time += time.perf_counter() - tic
+                stats.moves_searched += 1
+                score = self.minValue(board, opp_color, depth + 1, alpha, beta)
+                board.unmake_move()
+                if score > v:
+                    v = score
+                    best_move = move
+                if self.stopped:
+                    return v
+
+                alpha = max(alpha, v)
+                if alpha >= beta:
+                    stats.add_cutoff(index)
+                    self.ordering.update(board, move, depth, self.max_depth - depth)
+                    break
+                index += 1
+                tic = time.perf_counter()
 
+            self.store_table(board, depth, v, alpha_start, beta_start, best_move)
             return v
-            
 
-        def get_legal_moves(self, board, piece_color):
-            legal_moves = []
-            for piece in board.values():
-                if piece is not None:
-                    if piece.color == piece_color:
-                        moves = piece.generate_moves(board, self.game)
-                        for move in moves:
-                            if piece.is_legal_move(move, board, self.game):
-                                legal_moves.append([piece.position, piece.abbr, move])
+        def quiescence_leaf(self, board, depth, alpha, beta):
+            # Leaf score after the captures are played out, stored with the bound it proves
+            score = self.quiesce(board, alpha, beta, 0)
+            if not self.stopped:
+                self.store_table(board, depth, score, alpha, beta, None)
+            return score
 
-            return legal_moves
-        
+        def quiesce(self, board, alpha, beta, ply):
+            """
+            Search only captures and promotions (and checking moves at the first ply when
+            quiescence_checks is set) until the position is quiet. The side to move may stand
+            pat on the static score, and captures that cannot reach alpha are pruned.
+            Scores are from tt_color's point of view like the rest of the search.
+            """
+
+            if self.out_of_budget():
+                return 0
+
+            stats = self.stats
+            stats.max_depth = max(stats.max_depth, self.max_depth + 1 + ply)
+            maximizing = bitboard.COLOR_NAMES[board.turn] == self.tt_color
+            in_check = board.is_check()
+            if in_check:
+                # Every evasion has to be searched, and without one it is mate
+                tic = time.perf_counter()
+                moves = board.legal_moves()
+                stats.movegen_time += time.perf_counter() - tic
+                if not moves:
+                    return -math.inf if maximizing else math.inf
+                static = -math.inf if maximizing else math.inf
+            else:
+                static = self.evaluate_board(board, self.tt_color)
+                if maximizing:
+                    if static >= beta:
+                        return static
+                    alpha = max(alpha, static)
+                else:
+                    if static <= alpha:
+                        return static
+                    beta = min(beta, static)
 
-        def flip_board(self, board):
-            flip_board = copy.deepcopy(board)
-            for piece in flip_board:
-                flip_board[piece] = None
+                # Pseudo legal, legality is checked once a move is played
+                tic = time.perf_counter()
+                moves = board.capture_moves()
+                if self.quiescence_checks and ply == 0:
+                    for move in board.quiet_moves():
+                        board.make_move(move)
+                        if board.is_check():
+                            moves.append(move)
+                        board.unmake_move()
+                stats.movegen_time += time.perf_counter() - tic
+
+            v = static
+            for move in self.ordering.order(board, moves, None, self.ordering.max_ply):
+                if not in_check and not self.ordering.is_quiet(board, move):
+                    # Delta pruning, even winning the piece leaves the score short of the bound
+                    victim = board.mailbox[(move >> 6) & 63]
+                    gain = bitboard.PIECE_VALUES[victim[1]] if victim is not None else bitboard.PIECE_VALUES[bitboard.PAWN]
+                    if move >> 12:
+                        gain += bitboard.PIECE_VALUES[move >> 12] - bitboard.PIECE_VALUES[bitboard.PAWN]
+                    if maximizing and static + gain + DELTA_MARGIN <= alpha:
+                        continue
+                    if not maximizing and static - gain - DELTA_MARGIN >= beta:
+                        continue
+
+                board.make_move(move)
+                if board.is_check(board.turn ^ 1):
+                    board.unmake_move()
+                    continue
+                score = self.quiesce(board, alpha, beta, ply + 1)
+                board.unmake_move()
+                if self.stopped:
+                    return v
+
+                if maximizing:
+                    v = max(v, score)
+                    alpha = max(alpha, v)
+                else:
+                    v = min(v, score)
+                    beta = min(beta, v)
+                if alpha >= beta:
+                    break
+            return v
 
-            for piece in board.values():
-                if piece is not None:
-                    pos = self.switch_coordinates(piece)
-                    flip_board[pos] = piece
-            return flip_board
+        def probe_table(self, board, depth, alpha, beta):
+            """
+            Return a stored score for the position if it was searched at least as deep
+            and its bound settles the node for this alpha-beta window, otherwise None
+            """
+
+            stats = self.stats
+            stats.tt_probes += 1
+            entry = self.tt.probe(board.key)
+            if entry is None:
+                return None
+            stats.tt_hits += 1
+            if entry[1] < self.max_depth - depth:
+                return None
+            bound, score = entry[2], entry[3]
+            if bound == transposition.EXACT or (bound == transposition.LOWER and score >= beta) or (bound == transposition.UPPER and score <= alpha):
+                stats.tt_cutoffs += 1
+                return score
+            return None
+
+        def store_table(self, board, depth, v, alpha, beta, best_move):
+            # alpha and beta are the window the node was searched with
+            if v <= alpha:
+                bound = transposition.UPPER
+            elif v >= beta:
+                bound = transposition.LOWER
+            else:
+                bound = transposition.EXACT
+            self.tt.store(board.key, self.max_depth - depth, bound, v, best_move)
+            
+
+        def get_legal_moves(self, board, piece_color):
+            # Board is a bitboard Position with piece_color to move
+            return board.legal_moves()
         
 
         def board_to_FEN(self, board, turn, with_moves=False):
             # Convert the board into Forsyth–Edwards Notation
-            game = self.game
-            flip_board = self.flip_board(board)
-            fen_board = []
-            for count, piece in enumerate(flip_board.values(), 1):
-                if piece is not None:
-                    if piece.color == 'white':
-                        if piece.abbr == 'H':
-                            fen_board.append('N')
-                        else:
-                            fen_board.append(piece.abbr)
-                    elif piece.color == 'black':
-                        if piece.abbr == 'H':
-                            fen_board.append('n')
-                        else:
-                            fen_board.append(piece.abbr.lower())
-                else:
-                    try:
-                        fen_board[-1] += 1
-                    except:
-                        fen_board.append(1)
-                if count % 8 == 0 and count != 64:
-                    fen_board.append('/')
-            
-            fen_board.append(' {} '.format(turn[0].lower()))
-            fen_board.append(self.can_castle(board))
-            if with_moves == True:
-                if game.last_move != None:
-                    if game.last_move[1] == 'P':
-                        r_pos, c_pos = game.last_move[0]
-                        r_move, c_move = game.last_move[2]
-                        if r_move - r_pos == 2:
-                            move = self.alphabet[c_move] + '{}'.format(r_move)
-                            fen_board.append(' {} '.format(move))
-                        elif r_move - r_pos == -2:
-                            move = self.alphabet[c_move] + '{}'.format(r_move + 2)
-                            fen_board.append(' {} '.format(move))
-                        else:
-                            fen_board.append(' - ')
-                    else:
-                        fen_board.append(' - ')
-                else:
-                    fen_board.append(' - ')
-            
-                fen_board.append('{} '.format(game.halfmove))
-                fen_board.append('{}'.format(game.fullmove))
+            if isinstance(board, bitboard.Position):
+                return board.fen(with_moves)
 
-            fen_board_str = ''
-            for ele in fen_board:
-                fen_board_str += str(ele)
-
-            return fen_board_str
+            game = self.game
+            return chess_game.board_to_fen(board, turn, game.castling, game.last_move, game.halfmove, game.fullmove, with_moves)
         
 
         def can_castle(self, board):
             # Return if the kings can castle in FEN notation
             # ex: KQkq ; "K" if White can castle kingside, "Q" if White can castle queenside, "k" if Black can castle kingside, and "q" if Black can castle queenside.
-            fen_not = ''
-            for king in board.values():
-                if king is not None:
-                    if king.piece_type == "king" and king.moves_made == 0:
-                        if king.color == 'white':
-                            for rook in board.values():
-                                if rook is not None:
-                                    if rook.piece_type == 'rook' and rook.color == king.color and rook.moves_made == 0:
-                                        if rook.position == (0, 0):
-                                            fen_not = fen_not + 'Q'
-                                        else:
-                                            fen_not = 'K' + fen_not
-
-                        elif king.color == 'black':
-                            for rook in board.values():
-                                if rook is not None:
-                                    if rook.piece_type == 'rook' and rook.color == king.color and rook.moves_made == 0:
-                                        if rook.position == (7, 0):
-                                            fen_not = fen_not + 'q'
-                                        else:
-                                            try:
-                                                fen_not = fen_not[0] + fen_not[1] + 'k' + fen_not[2]
-                                            except:
-                                                fen_not = 'kq'
-            if fen_not == '':
-                fen_not = '-'
-            return fen_not
+            return bitboard.CASTLING_FEN[self.game.castling]
                                 
\ No newline at end of file
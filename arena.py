@@ -0,0 +1,285 @@
+"""
+Headless self-play arena
+
+Plays games between two ChessAI configurations, A and B, without the pygame
+window, several at a time on a process pool. A configuration is a list of
+key=value settings: depth, time (seconds per move) and nodes limit the
+search, and anything else, such as evaluator, is passed on to ChessAI.
+Each player has one engine process unless its configuration sets engines.
+Games come in pairs from the same opening, a few random moves from the
+start position, with A white in one and black in the other. A game ends on
+checkmate or one of ChessGame's draws, or is adjudicated a draw after
+max_plies. Writes the games as PGN and a JSON summary with the score, Elo
+difference, average think time and nodes per second. Run as a module:
+
+    python -m arena --games 200 --workers 8 --a depth=4 --b time=0.5
+    python -m arena --games 50 --a evaluator=native,depth=3 --b evaluator=stockfish,time=0.1
+"""
+
+import argparse
+import ast
+import datetime
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chess
+import chess.pgn
+
+import ai
+import bitboard
+import book
+import chess_game
+
+# Settings that limit get_best_move, the rest go to ChessAI
+SEARCH_SETTINGS = ('depth', 'time', 'nodes')
+DEFAULT_CONFIG = {'evaluator': 'native'}
+# Seconds per move of a configuration that sets no search limit
+DEFAULT_TIME = 1.0
+
+# Set in each worker process by _init_worker, the players by configuration name
+_players = None
+
+
+def parse_config(text):
+    """
+    Parse "depth=3,evaluator=native" into a configuration dict on top of DEFAULT_CONFIG
+    Values are read as Python literals where they can be, otherwise kept as strings
+    """
+
+    config = dict(DEFAULT_CONFIG)
+    for item in filter(None, text.split(',')):
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError("Expected key=value, got {!r}".format(item))
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        config[name.strip()] = value
+    if not any(key in config for key in SEARCH_SETTINGS):
+        config['time'] = DEFAULT_TIME
+    return config
+
+
+def _init_worker(configs):
+    global _players
+    _players = {}
+    for name, config in configs.items():
+        options = {key: value for key, value in config.items() if key not in SEARCH_SETTINGS}
+        # run compiled the book before the workers started
+        options['compile_book'] = False
+        # Games already run one per core, more engines per player would only compete for the CPU
+        options.setdefault('engines', 1)
+        player = ai.ChessAI('white', chess_game.ChessGame(), **options)
+        _players[name] = (player, config)
+
+
+def opening_moves(seed, plies):
+    # Random legal moves from the start position, the same for both games of a pair
+    rng = random.Random(seed)
+    position = bitboard.Position.from_fen(chess.STARTING_FEN)
+    moves = []
+    for ply in range(plies):
+        legal = position.legal_moves()
+        if not legal:
+            break
+        move = rng.choice(legal)
+        moves.append(move)
+        position.make_move(move)
+    return moves
+
+
+def play_game(index, white, black, seed, opening_plies=4, max_plies=300):
+    """
+    Play one game between the configurations named white and black in a worker
+    Returns {'index', 'white', 'black', 'moves' (UCI), 'result', 'reason', 'stats'}
+    with stats per configuration name of moves searched, think time and nodes
+    """
+
+    game = chess_game.ChessGame()
+    moves = []
+    for move in opening_moves(seed, opening_plies):
+        position = game.get_position()
+        game.make_move(position.move_to_list(move), game.board)
+        moves.append(bitboard.move_to_uci(move))
+
+    stats = {name: {'moves': 0, 'time': 0.0, 'nodes': 0} for name in (white, black)}
+    for name in stats:
+        player = _players[name][0]
+        # Games are independent, nothing is carried over from the last one
+        player.game = game
+        player.tt.clear()
+        player.eval_cache.clear()
+
+    while True:
+        status = game.game_status()
+        if status.result is not None:
+            if status.result == chess_game.CHECKMATE:
+                result = '0-1' if game.turn == 'white' else '1-0'
+            else:
+                result = '1/2-1/2'
+            reason = status.result
+            break
+        if len(moves) >= max_plies:
+            result, reason = '1/2-1/2', 'move limit'
+            break
+
+        name = white if game.turn == 'white' else black
+        player, config = _players[name]
+        player.nodes = 0
+        player.helper_nodes = 0
+        tic = time.perf_counter()
+        move = player.get_best_move(game.board, game.turn, config.get('depth'), config.get('time'), config.get('nodes'))
+        stats[name]['time'] += time.perf_counter() - tic
+        stats[name]['nodes'] += player.nodes + player.helper_nodes
+        stats[name]['moves'] += 1
+
+        position = game.get_position()
+        moves.append(bitboard.move_to_uci(position.move_from_list(move)))
+        game.make_move(move, game.board)
+
+    return {'index': index, 'white': white, 'black': black, 'moves': moves, 'result': result, 'reason': reason, 'stats': stats}
+
+
+def game_pgn(record, configs, event='Arena'):
+    # Build the PGN of a played game, with the configurations as player names
+    board = chess.Board()
+    for uci in record['moves']:
+        board.push_uci(uci)
+    pgn = chess.pgn.Game.from_board(board)
+    pgn.headers['Event'] = event
+    pgn.headers['Site'] = '?'
+    pgn.headers['Date'] = datetime.date.today().strftime('%Y.%m.%d')
+    pgn.headers['Round'] = str(record['index'] + 1)
+    pgn.headers['White'] = '{} ({})'.format(record['white'], format_config(configs[record['white']]))
+    pgn.headers['Black'] = '{} ({})'.format(record['black'], format_config(configs[record['black']]))
+    pgn.headers['Result'] = record['result']
+    pgn.headers['Termination'] = record['reason']
+    return pgn
+
+
+def format_config(config):
+    return ','.join('{}={}'.format(key, value) for key, value in config.items())
+
+
+def elo_difference(score):
+    # Elo difference that gives the expected score, None when one side won everything
+    if score <= 0 or score >= 1:
+        return None
+    return -400 * math.log10(1 / score - 1)
+
+
+def summarize(records, configs):
+    """
+    Score, Elo difference of A over B with a 95% margin, and think time and speed of each side
+    """
+
+    points = []
+    sides = {}
+    for name in configs:
+        sides[name] = {'config': configs[name], 'wins': 0, 'losses': 0, 'draws': 0, 'moves': 0, 'time': 0.0, 'nodes': 0}
+    reasons = {}
+    for record in records:
+        reasons[record['reason']] = reasons.get(record['reason'], 0) + 1
+        for name, stats in record['stats'].items():
+            for key in ('moves', 'time', 'nodes'):
+                sides[name][key] += stats[key]
+        if record['result'] == '1/2-1/2':
+            sides['A']['draws'] += 1
+            sides['B']['draws'] += 1
+            points.append(0.5)
+            continue
+        winner = record['white'] if record['result'] == '1-0' else record['black']
+        loser = 'B' if winner == 'A' else 'A'
+        sides[winner]['wins'] += 1
+        sides[loser]['losses'] += 1
+        points.append(1.0 if winner == 'A' else 0.0)
+
+    for side in sides.values():
+        side['avg_think_time'] = side['time'] / side['moves'] if side['moves'] else 0.0
+        side['nodes_per_second'] = side['nodes'] / side['time'] if side['time'] else 0.0
+
+    games = len(points)
+    score = sum(points) / games if games else 0.5
+    elo = elo_difference(score)
+    margin = None
+    if elo is not None and games > 1:
+        # 95% interval of the score, mapped onto the Elo scale
+        deviation = math.sqrt(sum((p - score) ** 2 for p in points) / (games - 1) / games)
+        low, high = elo_difference(score - 1.96 * deviation), elo_difference(score + 1.96 * deviation)
+        if low is not None and high is not None:
+            margin = (high - low) / 2
+
+    return {'games': games, 'score': score, 'elo_difference': elo, 'elo_margin': margin, 'reasons': reasons,
+            'A': sides['A'], 'B': sides['B']}
+
+
+def run(configs, games, workers=None, seed=0, opening_plies=4, max_plies=300, out=sys.stdout):
+    """
+    Play games between configs['A'] and configs['B'] on a pool of workers
+    Returns the game records in order
+    """
+
+    # Compile missing books once here, the workers only open them
+    for config in configs.values():
+        book.ensure_book(config.get('book_path', 'openings.bin'))
+
+    records = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(configs,)) as executor:
+        futures = []
+        for index in range(games):
+            # Both games of a pair start from the same opening, with colors swapped
+            white, black = ('A', 'B') if index % 2 == 0 else ('B', 'A')
+            futures.append(executor.submit(play_game, index, white, black, seed + index // 2, opening_plies, max_plies))
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            print(f"game {record['index'] + 1}: {record['white']} - {record['black']} {record['result']} ({record['reason']})", file=out)
+
+    records.sort(key=lambda record: record['index'])
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m arena', description="Play ChessAI configurations against each other.")
+    parser.add_argument('--a', default='', help="settings of configuration A, e.g. depth=4,evaluator=native")
+    parser.add_argument('--b', default='', help="settings of configuration B")
+    parser.add_argument('--games', type=int, default=10, help="number of games, played in pairs with colors swapped")
+    parser.add_argument('--workers', type=int, help="games played at once, default one per core")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random openings")
+    parser.add_argument('--opening-plies', type=int, default=4, help="random moves played before the engines take over")
+    parser.add_argument('--max-plies', type=int, default=300, help="plies after which a game is adjudicated a draw")
+    parser.add_argument('--pgn', default='arena.pgn', help="file the games are written to")
+    parser.add_argument('--summary', default='arena.json', help="file the JSON summary is written to")
+    args = parser.parse_args(argv)
+
+    configs = {'A': parse_config(args.a), 'B': parse_config(args.b)}
+    tic = time.perf_counter()
+    records = run(configs, args.games, args.workers, args.seed, args.opening_plies, args.max_plies)
+
+    with open(args.pgn, 'w') as pgn_file:
+        for record in records:
+            print(game_pgn(record, configs), file=pgn_file, end='\n\n')
+
+    summary = summarize(records, configs)
+    summary['time'] = time.perf_counter() - tic
+    with open(args.summary, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    elo = summary['elo_difference']
+    margin = summary['elo_margin']
+    print(f"A scored {summary['score']:.3f} over {summary['games']} games, Elo difference "
+          + ('n/a' if elo is None else f"{elo:+.0f}" + ('' if margin is None else f" +/- {margin:.0f}")))
+    for name in ('A', 'B'):
+        side = summary[name]
+        print(f"{name}: +{side['wins']} -{side['losses']} ={side['draws']}, "
+              f"{side['avg_think_time']:.3f} s per move, {side['nodes_per_second']:.0f} nodes per second")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Searching off the caller's thread
+
+BackgroundSearch runs ChessAI.get_best_move on a worker thread and hands
+back a concurrent.futures Future, so an event loop can poll it with done()
+and keep handling events and drawing. While it runs, the AI's progress
+attribute holds the last completed iteration. cancel() raises the AI's
+stop flag, the same flag the Lazy SMP helpers stop on, and the search stops
+at its next node.
+"""
+
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundSearch():
+
+    def __init__(self, ai):
+        self.ai = ai
+        # One worker, so a cancelled search is over before the next one starts
+        self.executor = ThreadPoolExecutor(1)
+        self.future = None
+        self.stop_flag = None
+
+    def _search(self, stop_flag, board, color, depth, time_limit, node_limit):
+        # Each search has its own flag, so cancelling one cannot stop the next
+        self.ai.stop_flag = stop_flag
+        self.ai.progress = None
+        return self.ai.get_best_move(board, color, depth, time_limit, node_limit)
+
+    def start(self, board, color, depth=None, time_limit=None, node_limit=None):
+        """
+        Start a search of board with color to move, as ChessAI.get_best_move
+        The board must not change until the search is done
+        Returns the Future of the move, None if it was cancelled before its first iteration
+        """
+
+        self.ai.progress = None
+        self.stop_flag = multiprocessing.RawValue('b', 0)
+        self.future = self.executor.submit(self._search, self.stop_flag, board, color, depth, time_limit, node_limit)
+        return self.future
+
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def cancel(self):
+        # Stop the current search, its move is thrown away
+        if self.future is None:
+            return
+        if not self.future.cancel():
+            self.stop_flag.value = 1
+        self.future = None
+
+    def close(self):
+        self.cancel()
+        self.executor.shutdown()
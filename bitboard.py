@@ -0,0 +1,972 @@
+"""
+Bitboard backed chess position
+
+Squares are numbered row * 8 + col using the same (row, col) layout as
+ChessGame.board, so row 0 is white's back rank and col 0 is the a file.
+Every piece type and color gets one 64 bit integer, with one occupancy
+mask per color, so occupancy, attack and material queries are a few
+integer operations instead of a walk over the 64 board entries.
+"""
+
+import random
+
+import evaluation
+
+WHITE = 0
+BLACK = 1
+COLOR_NAMES = ('white', 'black')
+
+PAWN, HORSE, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_TYPES = ('pawn', 'horse', 'bishop', 'rook', 'queen', 'king')
+PIECE_ABBRS = 'PHBRQK'
+FEN_LETTERS = 'PNBRQK'
+PIECE_VALUES = (100, 320, 330, 500, 900, 20000)
+
+# Castling rights, one bit each
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+# One shared (color, piece_type) tuple per piece, stored in Position.mailbox
+PIECES = tuple(tuple((color, piece_type) for piece_type in range(6)) for color in (WHITE, BLACK))
+
+FULL = (1 << 64) - 1
+# First and last rank, where pawn moves promote
+PROMOTION_RANKS = 0xff | (0xff << 56)
+# Squares of each color, for bishops that can never meet
+DARK_SQUARES = sum(1 << sq for sq in range(64) if (sq >> 3) % 2 == (sq & 7) % 2)
+LIGHT_SQUARES = FULL & ~DARK_SQUARES
+
+
+def square(row, col):
+    return row * 8 + col
+
+
+def square_coords(sq):
+    return divmod(sq, 8)
+
+
+def square_name(sq):
+    row, col = divmod(sq, 8)
+    return 'abcdefgh'[col] + str(row + 1)
+
+
+def popcount(bb):
+    return bb.bit_count()
+
+
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def iter_bits(bb):
+    # Yield the square of every set bit, lowest first
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def color_index(color):
+    # Accept either 'white'/'black' or WHITE/BLACK
+    if isinstance(color, str):
+        return WHITE if color == 'white' else BLACK
+    return color
+
+
+# Moves are packed into an int: from | to << 6 | promotion piece type << 12
+def make_move_code(from_sq, to_sq, promotion=0):
+    return from_sq | (to_sq << 6) | (promotion << 12)
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_promotion(move):
+    return move >> 12
+
+
+def move_to_uci(move):
+    name = square_name(move & 63) + square_name((move >> 6) & 63)
+    if move >> 12:
+        name += FEN_LETTERS[move >> 12].lower()
+    return name
+
+
+def _leaper_attacks(offsets):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        for i, j in offsets:
+            if 0 <= row + i < 8 and 0 <= col + j < 8:
+                bb |= 1 << square(row + i, col + j)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_attacks([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _leaper_attacks([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)])
+PAWN_ATTACKS = (_leaper_attacks([(1, -1), (1, 1)]), _leaper_attacks([(-1, -1), (-1, 1)]))
+
+# Sliding directions as (row step, col step). The first four point towards
+# higher square numbers, so the nearest blocker on those rays is the lowest bit.
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, -1), (-1, 1))
+POSITIVE_DIRECTIONS = frozenset(((1, 0), (0, 1), (1, 1), (1, -1)))
+
+
+def _build_rays():
+    rays = {}
+    for direction in DIRECTIONS:
+        i, j = direction
+        table = []
+        for sq in range(64):
+            row, col = divmod(sq, 8)
+            bb = 0
+            row += i
+            col += j
+            while 0 <= row < 8 and 0 <= col < 8:
+                bb |= 1 << square(row, col)
+                row += i
+                col += j
+            table.append(bb)
+        rays[direction] = table
+    return rays
+
+
+RAYS = _build_rays()
+
+
+def _sliding_attacks(sq, occupied, directions):
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def _build_lines():
+    # BETWEEN[a][b] holds the squares strictly between two aligned squares,
+    # LINE[a][b] the whole line through both of them
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for direction in DIRECTIONS:
+            opposite = (-direction[0], -direction[1])
+            full_line = RAYS[direction][sq] | RAYS[opposite][sq] | (1 << sq)
+            path = 0
+            for target in iter_bits(RAYS[direction][sq]) if direction in POSITIVE_DIRECTIONS else reversed(list(iter_bits(RAYS[direction][sq]))):
+                between[sq][target] = path
+                line[sq][target] = full_line
+                path |= 1 << target
+    return between, line
+
+
+BETWEEN, LINE = _build_lines()
+
+
+def bishop_attacks(sq, occupied):
+    return _sliding_attacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+def rook_attacks(sq, occupied):
+    return _sliding_attacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def queen_attacks(sq, occupied):
+    return _sliding_attacks(sq, occupied, DIRECTIONS)
+
+
+# Castling rights left after a move touches a square
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[square(0, 0)] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[square(0, 7)] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASK[square(0, 4)] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[square(7, 0)] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASK[square(7, 7)] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASK[square(7, 4)] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+
+# King destination -> (rook from, rook to) for castling moves
+CASTLING_ROOKS = {
+    square(0, 6): (square(0, 7), square(0, 5)),
+    square(0, 2): (square(0, 0), square(0, 3)),
+    square(7, 6): (square(7, 7), square(7, 5)),
+    square(7, 2): (square(7, 0), square(7, 3)),
+}
+
+PROMOTIONS = (QUEEN, ROOK, BISHOP, HORSE)
+
+# Zobrist keys, from a fixed seed so hashes stay the same between runs
+_zobrist_random = random.Random(20240607)
+ZOBRIST_PIECES = tuple(tuple(tuple(_zobrist_random.getrandbits(64) for sq in range(64)) for piece_type in range(6)) for color in (WHITE, BLACK))
+ZOBRIST_CASTLING = tuple(_zobrist_random.getrandbits(64) for rights in range(16))
+ZOBRIST_EP = tuple(_zobrist_random.getrandbits(64) for col in range(8))
+ZOBRIST_BLACK = _zobrist_random.getrandbits(64)
+
+
+def castling_from_board(board):
+    """
+    Castling rights of a ChessGame style board dictionary, for boards without a game
+    A board does not know which pieces have moved, so a king and rook on their
+    starting squares are taken to keep their right
+    """
+
+    castling = 0
+    for color, row, kingside, queenside in ((WHITE, 0, WHITE_KINGSIDE, WHITE_QUEENSIDE), (BLACK, 7, BLACK_KINGSIDE, BLACK_QUEENSIDE)):
+        king = board[(row, 4)]
+        if king is None or king.piece_type != KING or king.color != color:
+            continue
+        for col, right in ((7, kingside), (0, queenside)):
+            rook = board[(row, col)]
+            if rook is not None and rook.piece_type == ROOK and rook.color == color:
+                castling |= right
+    return castling
+
+
+def castling_from_mailbox(mailbox):
+    # castling_from_board for a Position's mailbox of (color, piece_type) entries
+    castling = 0
+    for color, row, kingside, queenside in ((WHITE, 0, WHITE_KINGSIDE, WHITE_QUEENSIDE), (BLACK, 7, BLACK_KINGSIDE, BLACK_QUEENSIDE)):
+        if mailbox[square(row, 4)] != (color, KING):
+            continue
+        for col, right in ((7, kingside), (0, queenside)):
+            if mailbox[square(row, col)] == (color, ROOK):
+                castling |= right
+    return castling
+
+
+def ep_square_from_board(board, turn, last_move):
+    """
+    En passant square of a ChessGame style board after last_move,
+    only when a pawn of the side to move can actually take on it
+    """
+
+    if last_move is None or last_move[1] != 'P':
+        return None
+    row, col = last_move[0]
+    row1, col1 = last_move[2]
+    if abs(row1 - row) != 2:
+        return None
+
+    turn = color_index(turn)
+    ep_row = (row + row1) // 2
+    capture_row = ep_row + (1 if row1 > row else -1)
+    for capture_col in (col1 - 1, col1 + 1):
+        if 0 <= capture_col < 8:
+            piece = board[(capture_row, capture_col)]
+            if piece is not None and piece.piece_type == PAWN and piece.color == turn:
+                return square(ep_row, col1)
+    return None
+
+
+# FEN letter of each (color, piece_type), and of each mailbox entry with '1' for an empty square
+FEN_SYMBOLS = tuple(tuple(letter if color == WHITE else letter.lower() for letter in FEN_LETTERS) for color in (WHITE, BLACK))
+MAILBOX_SYMBOLS = {PIECES[color][piece_type]: FEN_SYMBOLS[color][piece_type] for color in (WHITE, BLACK) for piece_type in range(6)}
+MAILBOX_SYMBOLS[None] = '1'
+# Runs of empty squares, longest first, and their FEN digit
+EMPTY_RUNS = tuple(('1' * n, str(n)) for n in range(8, 1, -1))
+CASTLING_LETTERS = ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'), (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q'))
+# FEN castling field of each set of rights
+CASTLING_FEN = tuple(''.join(letter for bit, letter in CASTLING_LETTERS if rights & bit) or '-' for rights in range(16))
+
+
+def placement_fen(symbols):
+    """
+    Piece placement field of FEN from the symbols of the 64 squares, a1 first,
+    with '1' for an empty square
+    """
+
+    text = '/'.join([''.join(symbols[sq:sq + 8]) for sq in range(56, -1, -8)])
+    for run, digit in EMPTY_RUNS:
+        text = text.replace(run, digit)
+    return text
+
+
+def make_fen(placement, turn, castling, ep_square=None, halfmove=0, fullmove=1, with_moves=True):
+    # Join the FEN fields, the en passant square and clocks only with_moves
+    fen = '{} {} {}'.format(placement, 'w' if turn == WHITE else 'b', CASTLING_FEN[castling])
+    if with_moves:
+        fen = '{} {} {} {}'.format(fen, '-' if ep_square is None else square_name(ep_square), halfmove, fullmove)
+    return fen
+
+
+def parse_fen(fen):
+    """
+    Split a FEN string into ([(square, color, piece_type), ...], turn, castling,
+    en passant square, halfmove, fullmove)
+    Missing fields after the placement default to white, no castling, no en passant square, 0 and 1
+    Raises ValueError for a malformed FEN
+    """
+
+    fields = fen.split()
+    rows = fields[0].split('/') if fields else []
+    if len(rows) != 8:
+        raise ValueError("Invalid FEN: {}".format(fen))
+
+    pieces = []
+    for i, text in enumerate(rows):
+        row = 7 - i
+        col = 0
+        for letter in text:
+            if letter.isdigit():
+                col += int(letter)
+            elif letter.upper() in FEN_LETTERS and col < 8:
+                color = WHITE if letter.isupper() else BLACK
+                pieces.append((square(row, col), color, FEN_LETTERS.index(letter.upper())))
+                col += 1
+            else:
+                raise ValueError("Invalid FEN: {}".format(fen))
+        if col != 8:
+            raise ValueError("Invalid FEN: {}".format(fen))
+
+    try:
+        turn = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+        castling = 0
+        if len(fields) > 2:
+            for bit, letter in CASTLING_LETTERS:
+                if letter in fields[2]:
+                    castling |= bit
+        ep_square = None
+        if len(fields) > 3 and fields[3] != '-':
+            if len(fields[3]) != 2:
+                raise ValueError
+            ep_square = square('12345678'.index(fields[3][1]), 'abcdefgh'.index(fields[3][0]))
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except (IndexError, ValueError):
+        raise ValueError("Invalid FEN: {}".format(fen))
+    return pieces, turn, castling, ep_square, halfmove, fullmove
+
+
+class Position():
+
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.mailbox = [None] * 64
+        self.turn = WHITE
+        self.castling = 0
+        self.ep_square = None
+        self.halfmove = 0
+        self.fullmove = 1
+        # Squares attacked by the piece on each square, and by each color
+        # Kept up to date by make_move, call refresh_attacks after put_piece/remove_piece
+        self.attacks = [0] * 64
+        self.attacked = [0, 0]
+        # Zobrist hash, updated by put_piece, remove_piece and make_move
+        self.key = 0
+        # Material + piece-square totals (white minus black) and game phase for evaluation
+        self.early_score = 0
+        self.late_score = 0
+        self.phase = 0
+        # Undo records pushed by make_move and popped by unmake_move
+        self.history = []
+        # Times each key has occurred since the last capture or pawn move, this position included
+        self.key_counts = {}
+
+    @classmethod
+    def from_board(cls, board, turn='white', last_move=None, halfmove=0, fullmove=1, key_history=None, castling=None):
+        """
+        Build a position from a ChessGame style board dictionary
+        castling is the game's castling rights, guessed from the board when None
+        key_history is the game's position keys, oldest first and ending with this one
+        """
+
+        position = cls()
+        for (row, col), piece in board.items():
+            if piece is not None:
+                position.put_piece(square(row, col), piece.color, piece.piece_type)
+
+        position.castling = castling_from_board(board) if castling is None else castling
+        position.turn = color_index(turn)
+        position.ep_square = ep_square_from_board(board, COLOR_NAMES[position.turn], last_move)
+        position.halfmove = halfmove
+        position.fullmove = fullmove
+
+        position.refresh_attacks()
+        position.key = position.compute_key()
+        position.count_keys(key_history)
+        return position
+
+    @classmethod
+    def from_fen(cls, fen, key_history=None):
+        """
+        Build a position from a FEN string
+        Missing clock fields default to 0 and 1
+        key_history is as for from_board
+        """
+
+        pieces, turn, castling, ep_square, halfmove, fullmove = parse_fen(fen)
+        position = cls()
+        for sq, color, piece_type in pieces:
+            position.put_piece(sq, color, piece_type)
+        position.turn = turn
+        # Drop rights whose king or rook is not on its starting square
+        position.castling = castling & castling_from_mailbox(position.mailbox)
+        if ep_square is not None:
+            position.set_ep_square(ep_square)
+        position.halfmove = halfmove
+        position.fullmove = fullmove
+
+        position.refresh_attacks()
+        position.key = position.compute_key()
+        position.count_keys(key_history)
+        return position
+
+    def count_keys(self, key_history=None):
+        # Only keys since the last capture or pawn move can come around again
+        self.key_counts = {}
+        for key in (key_history or [])[-(self.halfmove + 1):]:
+            self.key_counts[key] = self.key_counts.get(key, 0) + 1
+        if self.key not in self.key_counts:
+            self.key_counts[self.key] = 1
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.pieces = [self.pieces[0][:], self.pieces[1][:]]
+        position.occupied = self.occupied[:]
+        position.mailbox = self.mailbox[:]
+        position.turn = self.turn
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.attacks = self.attacks[:]
+        position.attacked = self.attacked[:]
+        position.key = self.key
+        position.early_score = self.early_score
+        position.late_score = self.late_score
+        position.phase = self.phase
+        # make_move shares one key_counts dict between the records of reversible moves,
+        # so each dict is copied once to keep that sharing in the copy
+        counts = {id(self.key_counts): dict(self.key_counts)}
+        position.history = [entry[:8] + (counts.setdefault(id(entry[8]), dict(entry[8])),) for entry in self.history]
+        position.key_counts = counts[id(self.key_counts)]
+        return position
+
+    def put_piece(self, sq, color, piece_type):
+        bit = 1 << sq
+        self.pieces[color][piece_type] |= bit
+        self.occupied[color] |= bit
+        self.mailbox[sq] = PIECES[color][piece_type]
+        self.key ^= ZOBRIST_PIECES[color][piece_type][sq]
+        self.early_score += evaluation.EARLY_SQUARE_VALUES[color][piece_type][sq]
+        self.late_score += evaluation.LATE_SQUARE_VALUES[color][piece_type][sq]
+        self.phase += evaluation.PHASE_WEIGHTS[piece_type]
+
+    def remove_piece(self, sq):
+        color, piece_type = self.mailbox[sq]
+        mask = ~(1 << sq)
+        self.pieces[color][piece_type] &= mask
+        self.occupied[color] &= mask
+        self.mailbox[sq] = None
+        self.key ^= ZOBRIST_PIECES[color][piece_type][sq]
+        self.early_score -= evaluation.EARLY_SQUARE_VALUES[color][piece_type][sq]
+        self.late_score -= evaluation.LATE_SQUARE_VALUES[color][piece_type][sq]
+        self.phase -= evaluation.PHASE_WEIGHTS[piece_type]
+
+    def compute_key(self):
+        """
+        Zobrist hash of the position from scratch
+        Covers pieces, side to move, castling rights and en passant file
+        """
+
+        key = ZOBRIST_CASTLING[self.castling]
+        for sq, piece in enumerate(self.mailbox):
+            if piece is not None:
+                key ^= ZOBRIST_PIECES[piece[0]][piece[1]][sq]
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP[self.ep_square & 7]
+        if self.turn == BLACK:
+            key ^= ZOBRIST_BLACK
+        return key
+
+    def piece_attacks(self, sq, occupied=None):
+        # Squares attacked by the piece on sq, own pieces included
+        piece = self.mailbox[sq]
+        if piece is None:
+            return 0
+        color, piece_type = piece
+        if piece_type == PAWN:
+            return PAWN_ATTACKS[color][sq]
+        if piece_type == HORSE:
+            return KNIGHT_ATTACKS[sq]
+        if piece_type == KING:
+            return KING_ATTACKS[sq]
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if piece_type == BISHOP:
+            return bishop_attacks(sq, occupied)
+        if piece_type == ROOK:
+            return rook_attacks(sq, occupied)
+        return queen_attacks(sq, occupied)
+
+    def refresh_attacks(self):
+        """
+        Rebuild the attack maps from scratch
+        """
+
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        self.attacks = [self.piece_attacks(sq, occupied) for sq in range(64)]
+        self._merge_attacks()
+
+    def _merge_attacks(self):
+        attacks = self.attacks
+        for color in (WHITE, BLACK):
+            attacked = 0
+            for sq in iter_bits(self.occupied[color]):
+                attacked |= attacks[sq]
+            self.attacked[color] = attacked
+
+    def _update_attacks(self, changed):
+        """
+        Update the attack maps after the squares in changed gained or lost a piece
+        Only pieces on those squares and sliders that reached them need recomputing
+        """
+
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        attacks = self.attacks = self.attacks[:]
+        white, black = self.pieces
+        sliders = (white[BISHOP] | white[ROOK] | white[QUEEN] | black[BISHOP] | black[ROOK] | black[QUEEN]) & ~changed
+        for sq in iter_bits(sliders):
+            if attacks[sq] & changed:
+                attacks[sq] = self.piece_attacks(sq, occupied)
+        for sq in iter_bits(changed):
+            attacks[sq] = self.piece_attacks(sq, occupied)
+        self.attacked = [0, 0]
+        self._merge_attacks()
+
+    def is_square_attacked(self, sq, by_color):
+        """
+        Return True if any piece of by_color attacks sq
+        """
+        return bool(self.attacked[color_index(by_color)] & (1 << sq))
+
+    def set_ep_square(self, sq):
+        # The side to move captures, so look for its pawns attacking the square
+        capturer = self.turn
+        if PAWN_ATTACKS[capturer ^ 1][sq] & self.pieces[capturer][PAWN]:
+            self.ep_square = sq
+        else:
+            self.ep_square = None
+
+    def piece_at(self, sq):
+        return self.mailbox[sq]
+
+    def occupied_all(self):
+        return self.occupied[WHITE] | self.occupied[BLACK]
+
+    def piece_count(self):
+        return popcount(self.occupied[WHITE] | self.occupied[BLACK])
+
+    def material(self, color):
+        color = color_index(color)
+        pieces = self.pieces[color]
+        return sum(PIECE_VALUES[piece_type] * popcount(pieces[piece_type]) for piece_type in range(6))
+
+    def insufficient_material(self):
+        """
+        Neither side can ever mate: bare kings, a single minor piece,
+        or only bishops that all stand on squares of one color
+        """
+
+        for color in (WHITE, BLACK):
+            pieces = self.pieces[color]
+            if pieces[PAWN] or pieces[ROOK] or pieces[QUEEN]:
+                return False
+        minors = [self.pieces[color][piece_type] for color in (WHITE, BLACK) for piece_type in (HORSE, BISHOP)]
+        count = sum(popcount(pieces) for pieces in minors)
+        if count <= 1:
+            return True
+        if self.pieces[WHITE][HORSE] or self.pieces[BLACK][HORSE]:
+            return False
+        bishops = self.pieces[WHITE][BISHOP] | self.pieces[BLACK][BISHOP]
+        return not bishops & DARK_SQUARES or not bishops & LIGHT_SQUARES
+
+    def repetitions(self):
+        # Number of earlier times this position occurred since the last capture or pawn move
+        return self.key_counts.get(self.key, 1) - 1
+
+    def king_square(self, color):
+        return lsb(self.pieces[color_index(color)][KING])
+
+    def attackers_to(self, sq, by_color, occupied=None):
+        """
+        Bitboard of every piece of by_color attacking sq
+        """
+
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        pieces = self.pieces[by_color]
+        queens = pieces[QUEEN]
+        return ((PAWN_ATTACKS[by_color ^ 1][sq] & pieces[PAWN])
+                | (KNIGHT_ATTACKS[sq] & pieces[HORSE])
+                | (KING_ATTACKS[sq] & pieces[KING])
+                | (bishop_attacks(sq, occupied) & (pieces[BISHOP] | queens))
+                | (rook_attacks(sq, occupied) & (pieces[ROOK] | queens)))
+
+    def is_check(self, color=None):
+        # Defaults to the side to move
+        color = self.turn if color is None else color_index(color)
+        return bool(self.attacked[color ^ 1] & self.pieces[color][KING])
+
+    def is_king_step_safe(self, king, to):
+        """
+        Return True if the king on king can step to to without being attacked
+        Sliders checking the king also attack the squares behind it
+        """
+
+        enemy = self.mailbox[king][0] ^ 1
+        if self.attacked[enemy] & (1 << to):
+            return False
+        if not self.attacked[enemy] & (1 << king):
+            return True
+        occupied = (self.occupied[WHITE] | self.occupied[BLACK]) ^ (1 << king)
+        return not self.attackers_to(to, enemy, occupied)
+
+    def piece_moves(self, sq, moves=None, mask=FULL):
+        """
+        Append the pseudo legal moves of the piece standing on sq
+        Only destinations in mask are kept, except en passant captures
+        """
+
+        if moves is None:
+            moves = []
+        color, piece_type = self.mailbox[sq]
+        own = self.occupied[color]
+        enemy = self.occupied[color ^ 1]
+        occupied = own | enemy
+
+        if piece_type == PAWN:
+            self._pawn_moves(sq, color, occupied, enemy, moves, mask)
+            return moves
+
+        if piece_type == HORSE:
+            targets = KNIGHT_ATTACKS[sq]
+        elif piece_type == BISHOP:
+            targets = bishop_attacks(sq, occupied)
+        elif piece_type == ROOK:
+            targets = rook_attacks(sq, occupied)
+        elif piece_type == QUEEN:
+            targets = queen_attacks(sq, occupied)
+        else:
+            targets = KING_ATTACKS[sq]
+            self._castling_moves(sq, color, occupied, moves)
+
+        targets &= ~own & mask
+        while targets:
+            low = targets & -targets
+            moves.append(sq | ((low.bit_length() - 1) << 6))
+            targets ^= low
+        return moves
+
+    def _pawn_moves(self, sq, color, occupied, enemy, moves, mask=FULL):
+        row = sq >> 3
+        if color == WHITE:
+            step, start_row, last_row = 8, 1, 6
+        else:
+            step, start_row, last_row = -8, 6, 1
+
+        targets = PAWN_ATTACKS[color][sq] & enemy
+        one = sq + step
+        if not occupied & (1 << one):
+            targets |= 1 << one
+            if row == start_row and not occupied & (1 << (one + step)):
+                targets |= 1 << (one + step)
+        targets &= mask
+        if self.ep_square is not None and PAWN_ATTACKS[color][sq] & (1 << self.ep_square):
+            targets |= 1 << self.ep_square
+
+        for to in iter_bits(targets):
+            if row == last_row:
+                for promotion in PROMOTIONS:
+                    moves.append(sq | (to << 6) | (promotion << 12))
+            else:
+                moves.append(sq | (to << 6))
+
+    def _castling_moves(self, sq, color, occupied, moves):
+        if color == WHITE:
+            home, kingside, queenside = 4, WHITE_KINGSIDE, WHITE_QUEENSIDE
+        else:
+            home, kingside, queenside = 60, BLACK_KINGSIDE, BLACK_QUEENSIDE
+        if sq != home or not self.castling & (kingside | queenside):
+            return
+
+        attacked = self.attacked[color ^ 1]
+        if self.castling & kingside and not occupied & (0b11 << (home + 1)):
+            if not attacked & (0b111 << home):
+                moves.append(home | ((home + 2) << 6))
+        if self.castling & queenside and not occupied & (0b111 << (home - 3)):
+            if not attacked & (0b111 << (home - 2)):
+                moves.append(home | ((home - 2) << 6))
+
+    def pseudo_legal_moves(self):
+        moves = []
+        for sq in iter_bits(self.occupied[self.turn]):
+            self.piece_moves(sq, moves)
+        return moves
+
+    def capture_moves(self):
+        """
+        Pseudo legal captures, en passant captures and promotions of the side to move
+        """
+
+        color = self.turn
+        enemy = self.occupied[color ^ 1]
+        moves = []
+        for sq in iter_bits(self.occupied[color]):
+            piece_type = self.mailbox[sq][1]
+            if piece_type == PAWN:
+                self.piece_moves(sq, moves, enemy | PROMOTION_RANKS)
+            elif piece_type == KING:
+                # piece_moves would add castling
+                for to in iter_bits(KING_ATTACKS[sq] & enemy):
+                    moves.append(sq | (to << 6))
+            else:
+                self.piece_moves(sq, moves, enemy)
+        return moves
+
+    def quiet_moves(self):
+        """
+        Pseudo legal moves of the side to move that capture and promote nothing, castling included
+        Together with capture_moves these are all the pseudo legal moves
+        """
+
+        color = self.turn
+        empty = FULL & ~(self.occupied[WHITE] | self.occupied[BLACK])
+        moves = []
+        for sq in iter_bits(self.occupied[color]):
+            if self.mailbox[sq][1] == PAWN:
+                # piece_moves always adds en passant, the only pawn move to the en passant square
+                for move in self.piece_moves(sq, None, empty & ~PROMOTION_RANKS):
+                    if (move >> 6) & 63 != self.ep_square:
+                        moves.append(move)
+            else:
+                self.piece_moves(sq, moves, empty)
+        return moves
+
+    def has_legal_move(self):
+        # Stop at the first pseudo legal move that does not leave the king attacked
+        king = lsb(self.pieces[self.turn][KING])
+        for move in self.piece_moves(king):
+            if self.is_legal(move):
+                return True
+        for sq in iter_bits(self.occupied[self.turn] & ~(1 << king)):
+            for move in self.piece_moves(sq):
+                if self.is_legal(move):
+                    return True
+        return False
+
+    def is_pseudo_legal(self, move):
+        # For moves that come from elsewhere, such as the transposition table
+        piece = self.mailbox[move & 63]
+        if piece is None or piece[0] != self.turn:
+            return False
+        return move in self.piece_moves(move & 63)
+
+    def checkers(self, color=None):
+        # Enemy pieces giving check to color's king, defaults to the side to move
+        color = self.turn if color is None else color_index(color)
+        return self.attackers_to(self.king_square(color), color ^ 1)
+
+    def pinned_pieces(self, color=None):
+        """
+        Bitboard of color's pieces pinned to their own king by an enemy slider
+        """
+
+        color = self.turn if color is None else color_index(color)
+        king = self.king_square(color)
+        enemy = self.pieces[color ^ 1]
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+
+        # Enemy sliders that would hit the king on an empty board
+        snipers = ((rook_attacks(king, 0) & (enemy[ROOK] | enemy[QUEEN]))
+                   | (bishop_attacks(king, 0) & (enemy[BISHOP] | enemy[QUEEN])))
+        pinned = 0
+        for sniper in iter_bits(snipers):
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1):
+                pinned |= blockers & self.occupied[color]
+        return pinned
+
+    def is_legal(self, move):
+        # A pseudo legal move is legal if it does not leave the mover's king attacked
+        color = self.mailbox[move & 63][0]
+        self.make_move(move)
+        in_check = self.is_check(color)
+        self.unmake_move()
+        return not in_check
+
+    def legal_moves(self):
+        """
+        Legal moves for the side to move
+        Checkers and pinned pieces are found once, then each piece only
+        generates moves that block or capture a checker and stay on its pin line
+        """
+
+        color = self.turn
+        enemy = color ^ 1
+        own = self.occupied[color]
+        occupied = own | self.occupied[enemy]
+        king = lsb(self.pieces[color][KING])
+        checkers = self.attackers_to(king, enemy) if self.attacked[enemy] & (1 << king) else 0
+        moves = []
+
+        # The king may step to any square not attacked once it has left its own
+        for to in iter_bits(KING_ATTACKS[king] & ~own & ~self.attacked[enemy]):
+            if not checkers or self.is_king_step_safe(king, to):
+                moves.append(king | (to << 6))
+
+        if checkers:
+            # Only the king can answer a double check
+            if checkers & (checkers - 1):
+                return moves
+            evasions = checkers | BETWEEN[king][lsb(checkers)]
+        else:
+            evasions = FULL
+            self._castling_moves(king, color, occupied, moves)
+
+        pinned = self.pinned_pieces(color)
+        ep_square = self.ep_square
+        for sq in iter_bits(own ^ (1 << king)):
+            mask = evasions
+            if pinned & (1 << sq):
+                mask &= LINE[king][sq]
+            start = len(moves)
+            self.piece_moves(sq, moves, mask)
+
+            # En passant removes two pieces from a line, so play it to check
+            if ep_square is not None and self.mailbox[sq][1] == PAWN and PAWN_ATTACKS[color][sq] & (1 << ep_square):
+                ep_move = sq | (ep_square << 6)
+                if ep_move in moves[start:] and not self.is_legal(ep_move):
+                    moves.remove(ep_move)
+        return moves
+
+    def make_move(self, move):
+        """
+        Play a pseudo legal move on this position in place
+        The move can be taken back with unmake_move
+        """
+
+        from_sq = move & 63
+        to_sq = (move >> 6) & 63
+        promotion = move >> 12
+        color, piece_type = self.mailbox[from_sq]
+        captured = self.mailbox[to_sq]
+        self.history.append((move, captured, self.castling, self.ep_square, self.halfmove, self.attacks, self.attacked, self.key, self.key_counts))
+        changed = (1 << from_sq) | (1 << to_sq)
+
+        self.halfmove += 1
+        if captured is not None:
+            self.remove_piece(to_sq)
+            self.halfmove = 0
+
+        if piece_type == PAWN:
+            self.halfmove = 0
+            if to_sq == self.ep_square:
+                ep_capture = to_sq - 8 if color == WHITE else to_sq + 8
+                self.remove_piece(ep_capture)
+                changed |= 1 << ep_capture
+
+        self.remove_piece(from_sq)
+        self.put_piece(to_sq, color, promotion or piece_type)
+
+        if piece_type == KING and abs(to_sq - from_sq) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[to_sq]
+            self.remove_piece(rook_from)
+            self.put_piece(rook_to, color, ROOK)
+            changed |= (1 << rook_from) | (1 << rook_to)
+
+        self._update_attacks(changed)
+        key = self.key ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_BLACK
+        self.castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if color == BLACK:
+            self.fullmove += 1
+        self.turn = color ^ 1
+
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP[self.ep_square & 7]
+        self.ep_square = None
+        if piece_type == PAWN and abs(to_sq - from_sq) == 16:
+            self.set_ep_square((from_sq + to_sq) // 2)
+            if self.ep_square is not None:
+                key ^= ZOBRIST_EP[self.ep_square & 7]
+        self.key = key
+
+        if self.halfmove == 0:
+            # No position from before a capture or pawn move can repeat
+            self.key_counts = {key: 1}
+        else:
+            self.key_counts[key] = self.key_counts.get(key, 0) + 1
+
+    def unmake_move(self):
+        """
+        Take back the last move played with make_move
+        """
+
+        move, captured, castling, ep_square, halfmove, self.attacks, self.attacked, key, key_counts = self.history.pop()
+        self.key_counts[self.key] -= 1
+        self.key_counts = key_counts
+        from_sq = move & 63
+        to_sq = (move >> 6) & 63
+        color = self.turn ^ 1
+        piece_type = PAWN if move >> 12 else self.mailbox[to_sq][1]
+
+        self.remove_piece(to_sq)
+        self.put_piece(from_sq, color, piece_type)
+
+        if piece_type == KING and abs(to_sq - from_sq) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[to_sq]
+            self.remove_piece(rook_to)
+            self.put_piece(rook_from, color, ROOK)
+
+        if captured is not None:
+            self.put_piece(to_sq, captured[0], captured[1])
+        elif piece_type == PAWN and to_sq == ep_square:
+            self.put_piece(to_sq - 8 if color == WHITE else to_sq + 8, color ^ 1, PAWN)
+
+        if color == BLACK:
+            self.fullmove -= 1
+        self.turn = color
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove = halfmove
+        self.key = key
+
+    def move_to_list(self, move):
+        # Convert a packed move into ChessGame's [(row, col), abbr, (row, col)] form
+        from_sq = move & 63
+        piece_type = self.mailbox[from_sq][1]
+        move_list = [square_coords(from_sq), PIECE_ABBRS[piece_type], square_coords((move >> 6) & 63)]
+        if move >> 12:
+            move_list.append(PIECE_ABBRS[move >> 12])
+        return move_list
+
+    def move_from_list(self, move_list):
+        promotion = 0
+        if len(move_list) > 3:
+            promotion = PIECE_ABBRS.index(move_list[3])
+        elif move_list[1] == 'P' and move_list[2][0] in (0, 7):
+            promotion = QUEEN
+        return make_move_code(square(*move_list[0]), square(*move_list[2]), promotion)
+
+    def fen(self, with_moves=True):
+        # Serialise the position in Forsyth-Edwards Notation
+        placement = placement_fen(list(map(MAILBOX_SYMBOLS.__getitem__, self.mailbox)))
+        return make_fen(placement, self.turn, self.castling, self.ep_square, self.halfmove, self.fullmove, with_moves)
@@ -0,0 +1,161 @@
+"""
+Compiled opening book
+
+The openings folder holds TSV files with a 'fen' column and a 'best_move'
+column in the [(row, col), abbr, (row, col)] move form. compile_book turns
+them into a binary hash table keyed by Zobrist key, which OpeningBook
+memory-maps and answers lookups from in O(1):
+
+    python -m book openings openings.bin
+
+File layout: an 8 byte magic, a uint32 slot count, then one record per slot
+of a uint64 key and a uint16 packed move. Empty slots have key 0.
+"""
+
+import argparse
+import ast
+import csv
+import mmap
+import os
+import struct
+import sys
+
+import bitboard
+
+MAGIC = b'CHSBOOK1'
+HEADER = struct.Struct('<8sI')
+RECORD = struct.Struct('<QH')
+
+
+def book_key(position):
+    """
+    Zobrist key used by the book, which ignores the en passant square
+    since the book FENs leave it out
+    """
+
+    key = position.key
+    if position.ep_square is not None:
+        key ^= bitboard.ZOBRIST_EP[position.ep_square & 7]
+    return key or 1
+
+
+def read_openings(folder):
+    # Yield (key, move) for every row of every TSV file in the folder
+    for file in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, file)) as f:
+            tsv_reader = csv.DictReader(f, delimiter="\t")
+            for row in tsv_reader:
+                position = bitboard.Position.from_fen(row['fen'])
+                move = position.move_from_list(ast.literal_eval(row['best_move']))
+                yield book_key(position), move
+
+
+def compile_book(folder, output):
+    """
+    Compile the TSV files in folder into a binary book at output
+    The first move found for a position wins. Returns the number of positions.
+    The book is written to a temporary file next to output and moved into place,
+    so a reader never sees it half written.
+    """
+
+    moves = {}
+    for key, move in read_openings(folder):
+        moves.setdefault(key, move)
+
+    # Open addressing with linear probing, at most half full
+    slots = 1
+    while slots < 2 * len(moves):
+        slots <<= 1
+    table = [(0, 0)] * slots
+    for key, move in moves.items():
+        index = key & (slots - 1)
+        while table[index][0]:
+            index = (index + 1) & (slots - 1)
+        table[index] = (key, move)
+
+    temp_path = '{}.{}.tmp'.format(output, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, slots))
+            for key, move in table:
+                f.write(RECORD.pack(key, move))
+        os.replace(temp_path, output)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(moves)
+
+
+class OpeningBook():
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not an opening book: {}".format(path))
+        self.mask = self.slots - 1
+
+    def lookup(self, position):
+        """
+        Return the packed book move for a Position, or None
+        A stored move that is not legal in the position, from a stale book, a bad
+        row or a key collision, is treated as missing
+        """
+
+        key = book_key(position)
+        index = key & self.mask
+        while True:
+            stored, move = RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+            if stored == key:
+                return move if move in position.legal_moves() else None
+            if stored == 0:
+                return None
+            index = (index + 1) & self.mask
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def ensure_book(path='openings.bin', folder='openings'):
+    """
+    Compile the book at path from folder if it is missing
+    Returns whether there is a book at path
+    """
+
+    if not os.path.exists(path):
+        if not os.path.isdir(folder):
+            return False
+        compile_book(folder, path)
+    return True
+
+
+def open_book(path='openings.bin', folder='openings', compile=True):
+    """
+    Open the compiled book at path, compiling it from folder first if it is missing
+    Worker processes pass compile=False and leave compiling to their parent
+    Returns None when there is no book to open
+    """
+
+    if compile:
+        ensure_book(path, folder)
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m book', description="Compile the openings folder into a binary book.")
+    parser.add_argument('folder', nargs='?', default='openings')
+    parser.add_argument('output', nargs='?', default='openings.bin')
+    args = parser.parse_args(argv)
+
+    count = compile_book(args.folder, args.output)
+    print(f"{count} positions written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
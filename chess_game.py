@@ -1,19 +1,77 @@
-import copy
+import bitboard
+from collections import deque, namedtuple
+
+# Results reported by ChessGame.game_status, None while the game goes on
+CHECKMATE = 'checkmate'
+STALEMATE = 'stalemate'
+REPETITION = 'repetition'
+FIFTY_MOVE = 'fifty-move rule'
+INSUFFICIENT_MATERIAL = 'insufficient material'
+DRAWS = (STALEMATE, REPETITION, FIFTY_MOVE, INSUFFICIENT_MATERIAL)
+
+GameStatus = namedtuple('GameStatus', ['in_check', 'has_legal_move', 'result'])
+
+# Positions whose status is remembered before the cache starts over
+STATUS_CACHE_SIZE = 1 << 16
+# Moves unmake_move can take back, deeper than any legality check, search or perft goes
+UNDO_LIMIT = 256
 
 class Piece():
+    """
+    A piece of one color and type
+    There is one shared, unchangeable instance per (color, piece_type) in PIECES.
+    color and piece_type are bitboard's small ints. The square a piece stands on is
+    its key in the board, and the game keeps the castling rights.
+    """
+
+    __slots__ = ('color', 'piece_type', 'abbr')
+
+    def __init__(self, color, piece_type):
+        object.__setattr__(self, 'color', color)
+        object.__setattr__(self, 'piece_type', piece_type)
+        object.__setattr__(self, 'abbr', bitboard.PIECE_ABBRS[piece_type])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Pieces are shared between boards and cannot be changed")
 
-    def __init__(self, color, piece_type, position, abbr):
-        self.color = color
-        self.piece_type = piece_type
-        self.position = position
-        self.abbr = abbr
-        self.moves_made = 0
+    def __reduce__(self):
+        # Unpickle to the shared instance
+        return get_piece, (self.color, self.piece_type)
 
-    def generate_moves(self, board, game):
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, bitboard.COLOR_NAMES[self.color])
+
+    def generate_moves(self, square, board, game):
         raise NotImplementedError("Subclasses must implement generate_moves")
 
-    def is_legal_move(self, move, board, game):
+    def is_legal_move(self, square, move, board, game):
         raise NotImplementedError("Subclasses must implement is_legal_move")
+
+    def bitboard_moves(self, square, position):
+        """
+        Given a bitboard Position, return the moves of the piece on square as (row, col) squares
+        """
+        moves = position.piece_moves(bitboard.square(*square))
+        return list(dict.fromkeys(bitboard.square_coords(bitboard.move_to(move)) for move in moves))
+
+    def bitboard_is_legal(self, square, move, position):
+        # Play the move on the position and check the king is not left attacked
+        to_sq = bitboard.square(*move)
+        for code in position.piece_moves(bitboard.square(*square)):
+            if bitboard.move_to(code) == to_sq:
+                return position.is_legal(code)
+        return False
+
+    def dict_is_legal(self, square, move, board, game):
+        moves = self.generate_moves(square, board, game)
+        if move not in moves:
+            return False
+        # Play the move on the board and take it back
+        # Check if move takes king out of check or into check
+        game.make_move([square, self.abbr, move], board)
+        in_check = self.is_check(board, game)
+        game.unmake_move(board)
+        return not in_check
     
     def is_check(self, board, game):
         """
@@ -21,118 +79,89 @@ class Piece():
         Used for castling
         """
 
-        # Find all squares that are under attack
-        is_check = False
-        danger_squares = []
-        for piece in board.values():
-            if piece is not None and piece.color != self.color and piece.piece_type != "king":
-                danger_moves = piece.generate_moves(board, game)
+        # Build the attack maps once instead of generating every enemy move
+        position = bitboard.Position.from_board(board, self.color)
+        return position.is_check(self.color)
 
-                danger_squares.extend(danger_moves)
 
-        # If king is under attack return true
-        for piece in board.values():
-            if piece is not None:
-                if piece.color == self.color and piece.piece_type == "king":
-                    if piece.position in danger_squares:
-                        is_check = True
-
-        return is_check
+class Pawn(Piece):
+        __slots__ = ()
 
+        def __init__(self, color):
+            super().__init__(color, bitboard.PAWN)
 
-class Pawn(Piece):
-        def __init__(self, color, position):
-            super().__init__(color, "pawn", position, "P")
 
+        def generate_moves(self, square, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
 
-        def generate_moves(self, board, game):
             moves = []
-            row, column = self.position
+            row, column = square
 
             # White pawn can move down the board 1 square
-            if self.color == "white" and row != 7:
+            if self.color == bitboard.WHITE and row != 7:
                 # If square ahead of pawn is empty, add to list
                 if board[(row + 1, column)] is None:
                     moves.append((row + 1, column))
 
                 # Allow pawns to take diagonally
-                if column + 1 <= 7 and board[(row + 1, column + 1)] is not None and board[(row + 1, column + 1)].color == "black":
+                if column + 1 <= 7 and board[(row + 1, column + 1)] is not None and board[(row + 1, column + 1)].color == bitboard.BLACK:
                     moves.append((row + 1, column + 1))
 
                 # Allow pawns to take diagonally
-                if column - 1 >= 0 and board[(row + 1, column - 1)] is not None and board[(row + 1, column - 1)].color == "black":
+                if column - 1 >= 0 and board[(row + 1, column - 1)] is not None and board[(row + 1, column - 1)].color == bitboard.BLACK:
                     moves.append((row + 1, column - 1))
 
             # Black pawn can move up the board 1 square
-            elif self.color == "black" and row != 0:
+            elif self.color == bitboard.BLACK and row != 0:
                 # If square ahead of pawn is empty, add to list
                 if board[(row - 1, column)] is None:
                     moves.append((row - 1, column))
 
                  # Allow pawns to take diagonally
-                if column + 1 <= 7 and board[(row - 1, column + 1)] is not None and board[(row - 1, column + 1)].color == "white":
+                if column + 1 <= 7 and board[(row - 1, column + 1)] is not None and board[(row - 1, column + 1)].color == bitboard.WHITE:
                     moves.append((row - 1, column + 1))
 
                  # Allow pawns to take diagonally
-                if column - 1 >= 0 and board[(row - 1, column - 1)] is not None and board[(row - 1, column - 1)].color == "white":
+                if column - 1 >= 0 and board[(row - 1, column - 1)] is not None and board[(row - 1, column - 1)].color == bitboard.WHITE:
                     moves.append((row - 1, column - 1))
 
-            # Allow pawns to double move if it has not moved yet
-            if self.moves_made == 0:
-                if self.color == "white" and board[(row + 2, column)] is None and board[(row + 1, column)] is None:
-                    moves.append((row + 2, column))
-                elif self.color == "black" and board[(row - 2, column)] is None and board[(row - 1, column)] is None:
-                    moves.append((row - 2, column))
-
-            # Allow en passant
-            if game.last_move is not None:
-                if game.last_move[1] == 'P':
-                    row, col = game.last_move[0]
-                    row1, col1 = game.last_move[2]
-                    # White pawn moved, Black pawn can take
-                    if row1 - row == 2:
-                        b_row, b_col = self.position
-                        # If white pawn is to the left
-                        if b_col > col1 and b_row == row1:
-                            moves.append((b_row - 1, b_col - 1))
-                        # If white pawn is to the right
-                        elif b_col < col1 and b_row == row1:
-                            moves.append((b_row - 1, b_col + 1))
-
-                    # Black pawn moved, White pawn can take
-                    elif row1 - row == -2:
-                        w_row, w_col = self.position
-                        # If black pawn is to the left
-                        if w_col > col1 and w_row == row1:
-                            moves.append((w_row + 1, w_col - 1))
-                        # If black pawn is to the right
-                        elif w_col < col1 and w_row == row1:
-                            moves.append((w_row + 1, w_col + 1))
+            # Allow pawns to double move from their starting rank
+            if self.color == bitboard.WHITE and row == 1 and board[(row + 2, column)] is None and board[(row + 1, column)] is None:
+                moves.append((row + 2, column))
+            elif self.color == bitboard.BLACK and row == 6 and board[(row - 2, column)] is None and board[(row - 1, column)] is None:
+                moves.append((row - 2, column))
+
+            # Allow en passant right after an enemy pawn's double move, from an adjacent file
+            last_move = game.last_move
+            if last_move is not None and last_move[1] == 'P':
+                (from_row, from_col), (to_row, to_col) = last_move[0], last_move[2]
+                direction = 1 if self.color == bitboard.WHITE else -1
+                if from_row - to_row == 2 * direction and row == to_row and abs(column - to_col) == 1:
+                    moves.append((to_row + direction, to_col))
 
             return moves
 
 
-        def is_legal_move(self, move, board, game):
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 
 class Horse(Piece):
+        __slots__ = ()
 
-        def __init__(self, color, position):
-            super().__init__(color, "horse", position, "H")
+        def __init__(self, color):
+            super().__init__(color, bitboard.HORSE)
 
-        def generate_moves(self, board, game):
+        def generate_moves(self, square, board, game):
             """ 
             Knight/Horse's Moves:
             """
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
+
             moves = []
             # Possible standard horse moves
             possible_moves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
@@ -140,7 +169,7 @@ class Horse(Piece):
             # Loop through possible moves
             # If destination is empty or an enemy piece, add move
             for i, j in possible_moves:
-                row, column = self.position
+                row, column = square
                 row += i
                 column += j
                 if 0 <= row < 8 and 0 <= column < 8 and (board[(row, column)] is None or board[(row, column)].color != self.color):
@@ -148,28 +177,26 @@ class Horse(Piece):
 
             return moves
 
-        def is_legal_move(self, move, board, game):
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 
 class Bishop(Piece):
+        __slots__ = ()
 
-        def __init__(self, color, position):
-            super().__init__(color, "bishop", position, "B")
+        def __init__(self, color):
+            super().__init__(color, bitboard.BISHOP)
 
-        def generate_moves(self, board, game):
+        def generate_moves(self, square, board, game):
             """Bishop's Moves:
             Check diagonal positions until an obstruction is encountered.
             If the obstruction is an opponent's piece, include it as a valid move (capture).
             """
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
+
 
             moves = []
             # Possible standard bishop moves
@@ -177,7 +204,7 @@ class Bishop(Piece):
 
             # Loop through possible moves until an enemy or boundry is found
             for i, j in possible_moves:
-                row, column = self.position
+                row, column = square
                 while True:
                     row += i
                     column += j
@@ -193,34 +220,32 @@ class Bishop(Piece):
 
             return moves
 
-        def is_legal_move(self, move, board, game):
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 class Rook(Piece):
+        __slots__ = ()
 
-        def __init__(self, color, position):
-            super().__init__(color, "rook", position, "R")
+        def __init__(self, color):
+            super().__init__(color, bitboard.ROOK)
 
-        def generate_moves(self, board, game):
+        def generate_moves(self, square, board, game):
             """ Rook's Moves:
             Check column/row until an obstruction is encountered.
             If the obstruction is an opponent's piece, include it as a valid move (capture).
             """
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
+
             moves = []
             # Possible standard rook moves
             possible_moves = [(-1, 0), (1, 0), (0, -1), (0, 1)]
 
             # Loop through possible moves until an enemy or boundry is found
             for i, j in possible_moves:
-                row, column = self.position
+                row, column = square
                 while True:
                     row += i
                     column += j
@@ -236,27 +261,25 @@ class Rook(Piece):
 
             return moves
 
-        def is_legal_move(self, move, board, game):
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 
 class Queen(Piece):
+        __slots__ = ()
 
-        def __init__(self, color, position):
-            super().__init__(color, "queen", position, "Q")
+        def __init__(self, color):
+            super().__init__(color, bitboard.QUEEN)
 
-        def generate_moves(self, board, game):
+        def generate_moves(self, square, board, game):
             """ Queen's Moves:
             Check position after move is in bounds and is not occupied by anotherpiece
             """
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
+
             moves = []
 
             # Possible standard queen moves
@@ -264,7 +287,7 @@ class Queen(Piece):
 
             # Loop through possible moves until an enemy or boundry is found
             for i, j in possible_moves:
-                row, column = self.position
+                row, column = square
                 while True:
                     row += i
                     column += j
@@ -280,126 +303,101 @@ class Queen(Piece):
 
             return moves
 
-        def is_legal_move(self, move, board, game):
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 
 class King(Piece):
+        __slots__ = ()
 
-        def __init__(self, color, position):
-            super().__init__(color, "king", position, "K")
+        def __init__(self, color):
+            super().__init__(color, bitboard.KING)
 
-        def generate_moves(self, board, game):
+        def generate_moves(self, square, board, game):
             """King's moves:
             If a move puts the king in check, it is excluded.
             King cannot move out of bounds or into an occupied square.
-            King can castle if it hasnt moved, rook has not moved, is not is check, and will not be in check after move
+            King can castle while the game keeps the right, if it is not in check and does not pass an attacked square
             """
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_moves(square, board)
+
 
             # Create list of moves
             moves = []
             # List of possible, standard king moves (one in each direction)
             possible_moves = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
 
+            # Build the attack maps once for every king step
+            position = bitboard.Position.from_board(board, self.color)
+            king = bitboard.square(*square)
+
             # Loop through each move
             for i, j in possible_moves:
-                row, column = self.position
+                row, column = square
                 row += i
                 column += j
                 # Check if the move is in bounds and the square is not occupied by ally piece
                 if 0 <= row < 8 and 0 <= column < 8 and (board[(row, column)] is None or board[(row, column)].color != self.color):
-                    # Temporarily update the board to check if the move puts the king in check
-                    temp_board = copy.deepcopy(board)
-                    temp_board[self.position] = None
-                    temp_board[(row, column)] = self
-                    
-                    # Check if the king is still under threat after the move
-                    danger_squares = []
-                    for piece in temp_board.values():
-                        if piece is not None and piece.color != self.color and piece.piece_type != 'king':
-                            danger_moves = piece.generate_moves(temp_board, game)
-                            danger_squares.extend(danger_moves)
-                    
-                        # If the king is not in check, the move is possible
-                    if not (row, column) in danger_squares:
+                    # If the king is not attacked on the square, the move is possible
+                    if position.is_king_step_safe(king, bitboard.square(row, column)):
                         moves.append((row, column))
-                
-                # Check if king can castle
-                if self.moves_made == 0:
-                    for piece in board.values():
-                        if piece is not None:
-                            if piece.piece_type == 'rook' and piece.color != self.color:
-                                row, col = self.position
-                                row1, col1 = piece.position
-                                # Rook is on right side
-                                if col1 > col:
-                                    # Path to rook is empty
-                                    if board[row, col + 1] is None and board[row, col + 2] is None:
-                                        moves.append((row, col + 2))
-                                # rook is on left side:
-                                else:  
-                                    # Path to rook is empty
-                                    if board[row, col - 1] is None and board[row, col - 2] is None and board[row, col - 3] is None:
-                                        moves.append((row, col + 2))
+
+            # Check if king can castle
+            row, col = square
+            kingside, queenside = CASTLING_RIGHTS[self.color]
+            enemy = self.color ^ 1
+            if game.castling & (kingside | queenside) and not position.is_check(self.color):
+                # Path to the rook is empty and the square the king passes is not attacked
+                if game.castling & kingside and board[(row, col + 1)] is None and board[(row, col + 2)] is None:
+                    if not position.is_square_attacked(king + 1, enemy):
+                        moves.append((row, col + 2))
+                if game.castling & queenside and board[(row, col - 1)] is None and board[(row, col - 2)] is None and board[(row, col - 3)] is None:
+                    if not position.is_square_attacked(king - 1, enemy):
+                        moves.append((row, col - 2))
 
             return moves
 
-        def is_legal_move(self, move, board, game):
-            # If the move is a castling move, handle it separately
-            if self.is_castling_move(move, board):
-                return True
-            
-            moves = self.generate_moves(board, game)
-            # Create a temporary board 
-            # Check if move takes king out of check or into check
-            temp_board = copy.deepcopy(board)
-            temp_board = game.make_move([self.position, self.abbr, move], temp_board)
-            if self.is_check(temp_board, game):
-                return False
-            else:
-                return move in moves
+        def is_legal_move(self, square, move, board, game):
+            if isinstance(board, bitboard.Position):
+                return self.bitboard_is_legal(square, move, board)
+            return self.dict_is_legal(square, move, board, game)
 
 
-        def is_castling_move(self, move, board):
-            # Check if the move is a castling move
-            if abs(move[1] - self.position[1]) == 2 and self.moves_made == 0:
-                row, col = self.position
-                if self.color == "white" and row == 0:
-                    if move[1] > self.position[1]:
-                        rook_position = (0, 7)
-                    else:
-                        rook_position = (0, 0)
-                elif self.color == "black" and row == 7:
-                    if move[1] > self.position[1]:
-                        rook_position = (7, 7)
-                    else:
-                        rook_position = (7, 0)
-
-                # Check if the rook is in the correct position and has not moved
-                rook = board[rook_position]
-                if rook is not None and rook.piece_type == "rook" and rook.color == self.color and rook.moves_made == 0:
-                    # Check if the squares between the king and the rook are empty
-                    if move[1] > self.position[1]:
-                        for col in range(self.position[1] + 1, move[1]):
-                            if board[(self.position[0], col)] is not None:
-                                return False
-                    else:
-                        for col in range(move[1] + 1, self.position[1]):
-                            if board[(self.position[0], col)] is not None:
-                                return False
+# Piece classes by bitboard piece type
+PIECE_CLASSES = (Pawn, Horse, Bishop, Rook, Queen, King)
+# The shared piece instances, PIECES[color][piece_type]
+PIECES = tuple(tuple(cls(color) for cls in PIECE_CLASSES) for color in (bitboard.WHITE, bitboard.BLACK))
+# Kingside and queenside castling rights of each color
+CASTLING_RIGHTS = ((bitboard.WHITE_KINGSIDE, bitboard.WHITE_QUEENSIDE), (bitboard.BLACK_KINGSIDE, bitboard.BLACK_QUEENSIDE))
 
-                    return True
 
-            return False
+def get_piece(color, piece_type):
+    # color may also be 'white'/'black' and piece_type an abbreviation
+    if isinstance(piece_type, str):
+        piece_type = bitboard.PIECE_ABBRS.index(piece_type)
+    return PIECES[bitboard.color_index(color)][piece_type]
+
+
+# Board squares in bitboard square order, a1 first
+SQUARES = tuple(bitboard.square_coords(sq) for sq in range(64))
+# FEN letter of each shared piece, '1' for an empty square
+PIECE_SYMBOLS = {piece: bitboard.FEN_SYMBOLS[piece.color][piece.piece_type] for pieces in PIECES for piece in pieces}
+PIECE_SYMBOLS[None] = '1'
+
 
+def board_to_fen(board, turn, castling, last_move=None, halfmove=0, fullmove=1, with_moves=True):
+    """
+    Serialise a ChessGame style board dictionary in Forsyth-Edwards Notation
+    turn is the side to move, castling the game's castling rights and last_move the move
+    that led to the board, for the en passant square
+    """
+
+    placement = bitboard.placement_fen([PIECE_SYMBOLS[board[square]] for square in SQUARES])
+    ep_square = bitboard.ep_square_from_board(board, turn, last_move) if with_moves else None
+    return bitboard.make_fen(placement, bitboard.color_index(turn), castling, ep_square, halfmove, fullmove, with_moves)
 
 
 class ChessGame():
@@ -411,11 +409,18 @@ class ChessGame():
             self.player2 = "black"
             self.turn = "white"
             self.last_move = None
-            self.board_states = []
-            board_state = self.convert_board_states(self.board)
-            self.board_states.append(board_state)
+            # Only the latest moves are kept, the game's own moves are never taken back
+            self.undo_stack = deque(maxlen=UNDO_LIMIT)
             self.halfmove = 0
             self.fullmove = 1
+            # Castling rights left, as bitboard's WHITE_KINGSIDE | ... flags
+            self.castling = bitboard.WHITE_KINGSIDE | bitboard.WHITE_QUEENSIDE | bitboard.BLACK_KINGSIDE | bitboard.BLACK_QUEENSIDE
+            # Zobrist hash of the game position, kept up to date by make_move
+            self.zobrist_key = bitboard.Position.from_board(self.board, castling=self.castling).key
+            # Keys of every position of the game, oldest first, for repetitions
+            self.key_history = [self.zobrist_key]
+            # Check, legal move and material results of game_status by Zobrist key
+            self.status_cache = {}
 
         @staticmethod
         def initialize_board():
@@ -429,30 +434,55 @@ class ChessGame():
                 for i in range(8):
                     board[(n, i)] = None
 
-            for n in range(8):
-                board[(1, n)] = Pawn("white", (1, n))
-                board[(6, n)] = Pawn("black", (6, n))
-
-            for n in range(8):
-                if n == 0 or n == 7:
-                    board[(0, n)] = Rook("white", (0, n))
-                    board[(7, n)] = Rook("black", (7, n))
-                elif n == 1 or n == 6:
-                    board[(0, n)] = Horse("white", (0, n))
-                    board[(7, n)] = Horse("black", (7, n))
-                elif n == 2 or n == 5:
-                    board[(0, n)] = Bishop("white", (0, n))
-                    board[(7, n)] = Bishop("black", (7, n))
-                elif n == 3:
-                    board[(0, n)] = Queen("white", (0, n))
-                    board[(7, n)] = Queen("black", (7, n))
-                elif n == 4:
-                    board[(0, n)] = King("white", (0, n))
-                    board[(7, n)] = King("black", (7, n))
+            white, black = PIECES
+            back_rank = (bitboard.ROOK, bitboard.HORSE, bitboard.BISHOP, bitboard.QUEEN, bitboard.KING, bitboard.BISHOP, bitboard.HORSE, bitboard.ROOK)
+            for n, piece_type in enumerate(back_rank):
+                board[(0, n)] = white[piece_type]
+                board[(1, n)] = white[bitboard.PAWN]
+                board[(6, n)] = black[bitboard.PAWN]
+                board[(7, n)] = black[piece_type]
 
             return board
 
 
+        def get_position(self):
+            """
+            Return a bitboard Position of the current game state
+            """
+            return bitboard.Position.from_board(self.board, self.turn, self.last_move, self.halfmove, self.fullmove, self.key_history, self.castling)
+
+        def fen(self, with_moves=True):
+            # Serialise the game position in Forsyth-Edwards Notation
+            return board_to_fen(self.board, self.turn, self.castling, self.last_move, self.halfmove, self.fullmove, with_moves)
+
+        @classmethod
+        def from_fen(cls, fen):
+            """
+            Start a game from a FEN string, with its castling rights, en passant square and clocks
+            The game's history starts at this position
+            Raises ValueError for a malformed FEN
+            """
+
+            pieces, turn, castling, ep_square, halfmove, fullmove = bitboard.parse_fen(fen)
+            game = cls()
+            game.board = {square: None for square in SQUARES}
+            for sq, color, piece_type in pieces:
+                game.board[bitboard.square_coords(sq)] = PIECES[color][piece_type]
+            game.turn = bitboard.COLOR_NAMES[turn]
+            # Drop rights whose king or rook is not on its starting square
+            game.castling = castling & bitboard.castling_from_board(game.board)
+            game.halfmove = halfmove
+            game.fullmove = fullmove
+            # The board finds the en passant square from the double pawn move before it
+            if ep_square is not None:
+                row, col = bitboard.square_coords(ep_square)
+                step = 1 if row == 2 else -1
+                game.last_move = [(row - step, col), 'P', (row + step, col)]
+            game.zobrist_key = game.get_position().key
+            game.key_history = [game.zobrist_key]
+            return game
+
+
         def get_move(self):
             """
             Get move from players
@@ -465,7 +495,7 @@ class ChessGame():
                 move_list = move_str.split()
                 move = [(int(move_list[0]), int(move_list[1])), move_list[2], (int(move_list[3]), int(move_list[4]))]
                 if self.board[move[0]] is not None and self.board[move[0]].abbr == move[1]:
-                    if self.board[move[0]].is_legal_move(move[2], self.board, self):
+                    if self.board[move[0]].is_legal_move(move[0], move[2], self.board, self):
                         return move
             except (SyntaxError, NameError, IndexError):
                 pass
@@ -480,72 +510,76 @@ class ChessGame():
             if board is self.board:
                 before_move_count = self.get_piece_count(self.board)
 
+            # Record what the move changes so unmake_move can take it back
+            moved = board[move[0]]
+            captured_square = move[2]
+            captured = board[move[2]]
+            rook_move = None
+            last_move, halfmove, fullmove, castling, zobrist_key = self.last_move, self.halfmove, self.fullmove, self.castling, self.zobrist_key
+            if board is self.board:
+                ep_square = bitboard.ep_square_from_board(board, self.turn, self.last_move)
+
             # Right side castle
             if move[1] == 'K' and col1 - col > 1:
                 # Change king's position
                 board[move[2]] = board[move[0]]
-                board[move[2]].position = move[2]
-                board[move[2]].moves_made += 1
                 board[move[0]] = None
                 # Change rook's position
                 if board[(0, 7)] is not None:
                     if self.turn == "white":
                         board[(0, 5)] = board[(0, 7)]
-                        board[(0, 5)].position = (0, 5)
                         board[(0, 7)] = None
+                        rook_move = ((0, 7), (0, 5))
                 if board[(7, 7)] is not None:
                     if self.turn == "black":
                         board[(7, 5)] = board[(7, 7)]
-                        board[(7, 5)].position = (7, 5)
                         board[(7, 7)] = None
+                        rook_move = ((7, 7), (7, 5))
             # Left side castle
             elif move[1] == 'K' and col - col1 > 1:
                 # Change king's position
                 board[move[2]] = board[move[0]]
-                board[move[2]].position = move[2]
-                board[move[2]].moves_made += 1
                 board[move[0]] = None
                 # Change rook's position
                 if board[(0, 0)] is not None:
                     if self.turn == "white":
                         board[(0, 3)] = board[(0, 0)]
-                        board[(0, 3)].position = (0, 3)
                         board[(0, 0)] = None
+                        rook_move = ((0, 0), (0, 3))
                 if board[(7, 0)] is not None:
                     if self.turn == "black":
                         board[(7, 3)] = board[(7, 0)]
-                        board[(7, 3)].position = (7, 3)
                         board[(7, 0)] = None
+                        rook_move = ((7, 0), (7, 3))
 
             # If white pawn is on last rank, allow promotion
+            # The piece to promote to can be given as a fourth entry, default is a queen
             elif move[1] == 'P' and row1 == 7:
                 board[(6, col)] = None
-                board[(7, col1)] = Queen('white', (7, col1))
+                board[(7, col1)] = get_piece(bitboard.WHITE, move[3] if len(move) > 3 else 'Q')
 
             # If black pawn in on last rank, allow promotion
             elif move[1] == 'P' and row1 == 0:
                 board[(1, col)] = None
-                board[(0, col1)] = Queen('black', (0, col1))
+                board[(0, col1)] = get_piece(bitboard.BLACK, move[3] if len(move) > 3 else 'Q')
 
             # If move is en passant
             elif move[1] == 'P' and (col1 - col == 1 or col1 - col == -1) and board[move[2]] is None:
                 row, col = move[2]
                 # Move pawn to new position
                 board[move[2]] = board[move[0]]
-                board[move[2]].position = move[2]
-                board[move[2]].moves_made += 1
                 board[move[0]] = None
                 # take the pawn using en passant
-                if board[move[2]].color == "white":
-                    board[(row - 1, col)] = None
-                elif board[move[2]].color == "black":
-                    board[(row + 1, col)] = None
+                if board[move[2]].color == bitboard.WHITE:
+                    captured_square = (row - 1, col)
+                else:
+                    captured_square = (row + 1, col)
+                captured = board[captured_square]
+                board[captured_square] = None
 
             # If move is not castling, promotion, or en passant, change position 
             else:
                 board[move[2]] = board[move[0]]
-                board[move[2]].position = move[2]
-                board[move[2]].moves_made += 1
                 board[move[0]] = None
 
             # Change the turn to move, last move, update halfmove clock, and fullmove number
@@ -563,114 +597,113 @@ class ChessGame():
                 if before_move_count != after_move_count or move[1] == 'P':
                     self.halfmove = 0
 
+                # Update the Zobrist key with only what the move changed
+                key = self.zobrist_key ^ bitboard.ZOBRIST_BLACK
+                key ^= self.piece_key(moved, move[0]) ^ self.piece_key(board[move[2]], move[2])
+                if captured is not None:
+                    key ^= self.piece_key(captured, captured_square)
+                if rook_move is not None:
+                    rook = board[rook_move[1]]
+                    key ^= self.piece_key(rook, rook_move[0]) ^ self.piece_key(rook, rook_move[1])
+                # A move from or onto a king or rook square takes those rights away
+                self.castling &= bitboard.CASTLING_MASK[bitboard.square(*move[0])] & bitboard.CASTLING_MASK[bitboard.square(*move[2])]
+                key ^= bitboard.ZOBRIST_CASTLING[castling] ^ bitboard.ZOBRIST_CASTLING[self.castling]
+                if ep_square is not None:
+                    key ^= bitboard.ZOBRIST_EP[ep_square & 7]
+                ep_square = bitboard.ep_square_from_board(board, self.turn, move)
+                if ep_square is not None:
+                    key ^= bitboard.ZOBRIST_EP[ep_square & 7]
+                self.zobrist_key = key
+                self.key_history.append(key)
+
+            self.undo_stack.append((move, moved, captured_square, captured, rook_move, last_move, halfmove, fullmove, castling, zobrist_key))
+
             return board
 
 
-        def is_check(self):
+        def unmake_move(self, board):
+            """
+            Take back the last move made with make_move on this board
+            Restores captured pieces, castling rooks, promoted pawns,
+            and if board is the game board, the turn, last move, castling rights and move clocks
+            """
 
-            # Find all squares that are under attack
-            is_check = False
-            danger_squares = []
-            for piece in self.board.values():
-                if piece is not None and piece.color != self.turn and piece.piece_type != "king":
-                    danger_moves = piece.generate_moves(self.board, self)
-                    danger_squares.extend(danger_moves)
+            move, moved, captured_square, captured, rook_move, last_move, halfmove, fullmove, castling, zobrist_key = self.undo_stack.pop()
 
-            # If king is under attack return True
-            for piece in self.board.values():
-                if piece is not None:
-                    if piece.color == self.turn and piece.piece_type == "king":
-                        if piece.position in danger_squares:
-                            is_check = True
+            board[move[2]] = None
+            board[move[0]] = moved
+            board[captured_square] = captured
 
-            return is_check
+            if rook_move is not None:
+                rook_from, rook_to = rook_move
+                board[rook_from] = board[rook_to]
+                board[rook_to] = None
 
-        def is_checkmate(self):
-            is_checkmate = True
-
-            # Must be in check to be in checkmate
-            if self.is_check():
-                # loop through non-None pieces
-                for piece in self.board.values():
-                    if piece is not None:
-                        # If the piece is the right color, a king, and has no moves, continue
-                        if piece.color == self.turn and piece.piece_type == "king":
-                            # Create a temporary board and loop through pieces
-                            for piece2 in self.board.values():
-                                if piece2 is not None:
-                                    """ For every piece that is not the king and the correct color,
-                                    Generate their moves, make that move in the temporary board
-                                    If the move takes the king out of check, it is not checkmate
-                                    If no moves take the king out of check, it is checkmate
-                                    """
-                                    if piece2.color == self.turn:
-                                        moves = piece2.generate_moves(self.board, self)
-                                        for move in moves:
-                                            temp_board = copy.deepcopy(self.board)
-                                            temp_board = self.make_move([piece2.position, piece2.abbr, move], temp_board)
-                                            for piece in self.board.values():
-                                                if piece is not None:
-                                                    if piece.color == self.turn and piece.piece_type == "king":
-                                                        if not piece.is_check(temp_board, self):
-                                                            is_checkmate = False
-                                                            break
-            else:
-                is_checkmate = False
+            if board is self.board:
+                self.turn = "white" if self.turn == "black" else "black"
+                self.last_move = last_move
+                self.halfmove = halfmove
+                self.fullmove = fullmove
+                self.castling = castling
+                self.zobrist_key = zobrist_key
+                self.key_history.pop()
 
-            return is_checkmate
+            return board
 
+        @staticmethod
+        def piece_key(piece, square):
+            # Zobrist key of a piece standing on a (row, col) square
+            return bitboard.ZOBRIST_PIECES[piece.color][piece.piece_type][bitboard.square(*square)]
 
-        def is_stalemate(self):
-            is_stalemate = False
-            num1 = 0
-            num2 = 0
-
-            if not self.is_check():
-                # loop through every piece of the correct color
-                for piece in self.board.values():
-                    if piece is not None:
-                        if piece.color == self.turn:
-                            # Increase num1 for every piece of correct color
-                            num1 += 1
-                            # Increase num2 if that piece has no legal moves
-                            moves = piece.generate_moves(self.board, self)
-                            for move in moves:
-                                if not piece.is_legal_move(move, self.board, self):
-                                    num2 += 1
-                            if not moves:
-                                num2 += 1
-                # If every piece of the correct color has no moves, it is stalemate
-                if num1 == num2:
-                    is_stalemate = True
-
-            if not is_stalemate:
-                board_state = self.convert_board_states(self.board)
-                is_stalemate = self.draw_by_rep(board_state)
-                
-            return is_stalemate
-
-
-        def draw_by_rep(self, board_state):
-            count = 0
-            for state in self.board_states:
-                if state == board_state:
-                    count += 1
-                    if count >= 3:
-                        return True
-            return False
-        
-        def convert_board_states(self, board):
-            board_state = []
-            for square in board:
-                if board[square] is not None:
-                    pos = board[square].position
-                    piece_type = board[square].piece_type
-                    color = board[square].color
-                    board_state.append({pos: (piece_type, color)})
-                else:
-                    board_state.append(None)
 
-            return board_state
+        def is_square_attacked(self, square, by_color):
+            """
+            Given a (row, col) square, check if any piece of by_color attacks it
+            """
+            return self.get_position().is_square_attacked(bitboard.square(*square), by_color)
+
+        def is_check(self):
+            # Look the king up in the position's attack maps
+            return self.get_position().is_check(self.turn)
+
+        def game_status(self, position=None):
+            """
+            Given a bitboard Position, the game position by default, return a GameStatus
+            of whether the side to move is in check, whether it has a legal move, and the
+            result: checkmate, one of the DRAWS, or None
+            Check, legal moves and material only depend on the position so they are cached by
+            its hash. Repetitions and the fifty-move clock depend on how it was reached.
+            """
+
+            if position is None:
+                position = self.get_position()
+
+            cached = self.status_cache.get(position.key)
+            if cached is None:
+                if len(self.status_cache) >= STATUS_CACHE_SIZE:
+                    self.status_cache.clear()
+                cached = (position.is_check(), position.has_legal_move(), position.insufficient_material())
+                self.status_cache[position.key] = cached
+            in_check, has_legal_move, insufficient_material = cached
+
+            if not has_legal_move:
+                result = CHECKMATE if in_check else STALEMATE
+            elif position.repetitions() >= 2:
+                result = REPETITION
+            elif position.halfmove >= 100:
+                result = FIFTY_MOVE
+            elif insufficient_material:
+                result = INSUFFICIENT_MATERIAL
+            else:
+                result = None
+            return GameStatus(in_check, has_legal_move, result)
+
+        def is_checkmate(self):
+            return self.game_status().result == CHECKMATE
+
+        def is_stalemate(self):
+            # Reports every kind of draw, as it already did for repetition
+            return self.game_status().result in DRAWS
 
 
         def map_coordinates_to_chessboard(self, x, y, square_size, top_space, window_width, right_space):
@@ -696,6 +729,9 @@ class ChessGame():
 
         
         def get_piece_count(self, board):
+            if isinstance(board, bitboard.Position):
+                return board.piece_count()
+
             piece_count = 0
             for piece in board.values():
                 if piece is not None:
@@ -723,12 +759,7 @@ class ChessGame():
                         elif board[(n, i - 1)] is None:
                             print(' x  ', end="")
                         else:
-                            print(' P  ', end="") if board[(n, i - 1)].piece_type == "pawn" else None
-                            print(' B  ', end="") if board[(n, i - 1)].piece_type == "bishop" else None
-                            print(' H  ', end="") if board[(n, i - 1)].piece_type == "horse" else None
-                            print(' R  ', end="") if board[(n, i - 1)].piece_type == "rook" else None
-                            print(' Q  ', end="") if board[(n, i - 1)].piece_type == "queen" else None
-                            print(' K  ', end="") if board[(n, i - 1)].piece_type == "king" else None
+                            print(' {}  '.format(board[(n, i - 1)].abbr), end="")
                     print(end='\n')
 
             print(" ", end="")
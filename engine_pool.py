@@ -0,0 +1,152 @@
+"""
+Pool of UCI engine processes for leaf evaluation
+
+The pool runs the asyncio chess.engine API on its own event loop thread,
+so the synchronous search can hand it one position or a whole batch. A
+batch is spread over every engine in the pool at once. Engines are
+started on first use, and an engine that dies is replaced and the request
+retried once.
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+
+import chess
+import chess.engine
+
+DEFAULT_ENGINE = "stockfish-windows-x86-64-avx2.exe"
+MATE_SCORE = 100000
+
+# Pools that have not been closed yet, closed when the interpreter exits
+_live_pools = weakref.WeakSet()
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_live_pools):
+        pool.close()
+
+
+class EnginePool():
+
+    def __init__(self, path=DEFAULT_ENGINE, size=None, options=None):
+        self.path = path
+        self.size = size or os.cpu_count() or 1
+        self.options = options or {}
+        self.engines = []
+        self.idle = None
+        self.starting = 0
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+        _live_pools.add(self)
+
+    def _ensure_loop(self):
+        # Start the event loop thread the first time the pool is used
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="engine-pool", daemon=True)
+                self.thread.start()
+                self.idle = asyncio.Queue()
+
+    async def _start_engine(self):
+        # Counted while it starts, so a restart does not let _acquire go past size
+        self.starting += 1
+        try:
+            transport, engine = await chess.engine.popen_uci(self.path)
+            if self.options:
+                await engine.configure(self.options)
+        finally:
+            self.starting -= 1
+        self.engines.append(engine)
+        return engine
+
+    async def _acquire(self):
+        # Start another engine while the pool is below size, otherwise wait for an idle one
+        if self.idle.empty() and len(self.engines) + self.starting < self.size:
+            return await self._start_engine()
+        return await self.idle.get()
+
+    async def _replace(self, engine):
+        if engine in self.engines:
+            self.engines.remove(engine)
+        try:
+            await engine.quit()
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError):
+            pass
+        return await self._start_engine()
+
+    async def _release(self, engine):
+        # Put the engine back for the next request, or a new one in its place if it died
+        if engine not in self.engines:
+            return
+        if engine.returncode.done():
+            self.engines.remove(engine)
+            try:
+                engine = await self._start_engine()
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError):
+                # _acquire starts another once the pool is below size
+                return
+        self.idle.put_nowait(engine)
+
+    async def _analyse(self, fen, color, limit):
+        board = chess.Board(fen)
+        engine = await self._acquire()
+        try:
+            try:
+                info = await engine.analyse(board, limit)
+            except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+                # The engine crashed or misbehaved, restart it and try once more
+                failed, engine = engine, None
+                engine = await self._replace(failed)
+                info = await engine.analyse(board, limit)
+        finally:
+            # However the analysis ended, cancelled or timed out included, the engine is not lost
+            if engine is not None:
+                await self._release(engine)
+        return info["score"].pov(color == 'white').score(mate_score=MATE_SCORE)
+
+    async def _analyse_many(self, fens, color, limit):
+        return await asyncio.gather(*(self._analyse(fen, color, limit) for fen in fens))
+
+    def analyse(self, fen, color, time=None, nodes=None):
+        """
+        Score of a FEN from color's point of view
+        time is in seconds, nodes caps the engine's search, either may be None
+        """
+
+        self._ensure_loop()
+        limit = chess.engine.Limit(time=time, nodes=nodes)
+        return asyncio.run_coroutine_threadsafe(self._analyse(fen, color, limit), self.loop).result()
+
+    def analyse_many(self, fens, color, time=None, nodes=None):
+        """
+        Scores of several FENs from color's point of view, analysed concurrently
+        """
+
+        self._ensure_loop()
+        limit = chess.engine.Limit(time=time, nodes=nodes)
+        return asyncio.run_coroutine_threadsafe(self._analyse_many(fens, color, limit), self.loop).result()
+
+    def close(self):
+        # Quit every engine and stop the event loop thread
+        _live_pools.discard(self)
+        if self.loop is None or not self.loop.is_running():
+            return
+
+        async def quit_all():
+            for engine in self.engines:
+                try:
+                    await engine.quit()
+                except (chess.engine.EngineError, chess.engine.EngineTerminatedError, OSError):
+                    pass
+            self.engines = []
+
+        asyncio.run_coroutine_threadsafe(quit_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop = None
@@ -0,0 +1,61 @@
+"""
+Bounded LRU cache of leaf evaluations
+
+Engine evaluations cost a full engine call, and the same leaves come up
+again within a search and across consecutive moves. The cache keeps them
+keyed by (Zobrist key, color, limit), so a score is only reused for the
+same position, the same point of view and the same engine limit. The
+least recently used entry is dropped once the memory cap is reached.
+"""
+
+from collections import OrderedDict
+
+# Rough size of one entry: the key tuple, the score and the dict slot
+ENTRY_BYTES = 200
+
+
+class EvalCache():
+
+    def __init__(self, max_bytes=16 << 20):
+        self.max_bytes = max_bytes
+        self.max_entries = max(max_bytes // ENTRY_BYTES, 1)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, color, limit):
+        """
+        Return the cached score, or None
+        """
+
+        entry_key = (key, color, limit)
+        score = self.entries.get(entry_key)
+        if score is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(entry_key)
+        self.hits += 1
+        return score
+
+    def contains(self, key, color, limit):
+        # Whether a score is cached, without counting a lookup or refreshing it
+        return (key, color, limit) in self.entries
+
+    def put(self, key, color, limit, score):
+        entry_key = (key, color, limit)
+        self.entries[entry_key] = score
+        self.entries.move_to_end(entry_key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
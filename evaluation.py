@@ -1,50 +1,14 @@
-def evaluate_board(self, board, color):
-    # Use stockfishes evaluation function
-    tic = time.perf_counter()
-    material_score = 0
-    phase = self.get_game_phase(board)
-
-    if self.game.is_checkmate():
-        return -10000
-    
-    if self.game.is_checkmate():
-        return -100
-
-    for piece in board.values():
-        if piece is not None:
-            if piece.color == color:
-                material_score += self.piece_values[piece.abbr]
-            else:
-                material_score -= self.piece_values[piece.abbr]
-
-            if piece.color == color and color == 'white':
-                row, col = self.switch_coordinates(piece)
-                if piece.piece_type == 'king' and phase == 'early':
-                    material_score += piece_square_tables['early_{}'.format(piece.piece_type)][row][col]
-                elif piece.piece_type == 'king' and phase == 'late':
-                    material_score += piece_square_tables['late_{}'.format(piece.piece_type)][row][col]
-                else:
-                    material_score += piece_square_tables[piece.piece_type][row][col]
-            elif piece.color == color and color == 'black':
-                row, col = piece.position
-                if piece.piece_type == 'king' and phase == 'early':
-                    material_score += piece_square_tables['early_{}'.format(piece.piece_type)][row][col]
-                elif piece.piece_type == 'king' and phase == 'late':
-                    material_score += piece_square_tables['late_{}'.format(piece.piece_type)][row][col]
-                else:
-                    material_score += piece_square_tables[piece.piece_type][row][col]
-
-    # Scale the material score based on the game phase
-    if phase == "early":
-        material_score *= 0.8
-    elif phase == "late":
-        material_score *= 1.4
-
-    toc = time.perf_counter()
-    print(f"evaluated board in {toc - tic:0.4f} seconds")
-
-    return material_score
+"""
+Static evaluation from material and piece-square tables
 
+The tables are written from white's side of the board, so white pieces
+read them upside down. The king has an early and a late game table and
+the two are blended by game phase (tapered evaluation), as is the overall
+score scaling. Position keeps the material + table sums up to date in
+put_piece and remove_piece, so evaluating a leaf is a few multiplications.
+"""
+
+import numpy as np
 
 pawn_table = [
     [0, 0, 0, 0, 0, 0, 0, 0],
@@ -131,4 +95,54 @@ piece_square_tables = {
     'queen': queen_table,
     'early_king': early_king_table,
     'late_king': late_king_table,
-}
\ No newline at end of file
+}
+
+
+PIECE_VALUES = (100, 320, 330, 500, 900, 20000)
+TABLE_NAMES = ('pawn', 'horse', 'bishop', 'rook', 'queen', 'king')
+
+# Game phase counts minor pieces as 1, rooks as 2 and queens as 4
+PHASE_WEIGHTS = (0, 1, 1, 2, 4, 0)
+MAX_PHASE = 24
+
+# Score scaling from the opening to the endgame
+EARLY_SCALE = 0.8
+LATE_SCALE = 1.4
+
+
+def _build_tables(king_table):
+    """
+    Material plus piece-square value for every (color, piece type, square)
+    Black values are negative so a position's total is white minus black
+    """
+
+    values = np.zeros((2, 6, 64), dtype=np.int32)
+    for piece_type, name in enumerate(TABLE_NAMES):
+        table = np.array(king_table if name == 'king' else piece_square_tables[name], dtype=np.int32)
+        values[0, piece_type] = PIECE_VALUES[piece_type] + table[::-1].reshape(64)
+        values[1, piece_type] = -(PIECE_VALUES[piece_type] + table.reshape(64))
+    return values
+
+
+EARLY_VALUES = _build_tables(early_king_table)
+LATE_VALUES = _build_tables(late_king_table)
+
+# Plain list copies, indexing these is much faster than numpy for single squares
+EARLY_SQUARE_VALUES = EARLY_VALUES.tolist()
+LATE_SQUARE_VALUES = LATE_VALUES.tolist()
+
+
+class Evaluator():
+
+    def evaluate(self, position, color):
+        """
+        Score of a Position from color's point of view
+        """
+
+        phase = min(position.phase, MAX_PHASE)
+        late_phase = MAX_PHASE - phase
+        score = (position.early_score * phase + position.late_score * late_phase) / MAX_PHASE
+        score *= (EARLY_SCALE * phase + LATE_SCALE * late_phase) / MAX_PHASE
+        if color == 'white' or color == 0:
+            return score
+        return -score
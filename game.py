@@ -1,7 +1,8 @@
 import pygame
 import chess_game as chess
 import ai
-import math
+import background
+import bitboard
 
 # Global Variables
 BACKGROUND_COLOR = (32, 32, 32)
@@ -9,6 +10,8 @@ WINDOW_WIDTH = 1000
 WINDOW_HEIGHT = 900
 TOP_SPACE = 100
 RIGHT_SPACE = 200
+# Seconds the AI may think per move
+AI_MOVE_TIME = 5
 
 # Initialize Pygame
 pygame.init()
@@ -18,6 +21,69 @@ pygame.display.set_caption("Chess")
 screen.fill(BACKGROUND_COLOR)
 pygame.display.flip()
 
+# Loaded once and reused by every redraw
+# Piece sprites by (color, piece_type, square_size), converted and scaled to the square
+piece_images = {}
+# Fonts by size
+fonts = {}
+# Rendered text by (text, size, color, background)
+labels = {}
+
+# Function to get a piece sprite from the cache, loading it on first use
+def get_piece_image(piece, square_size):
+    key = (piece.color, piece.piece_type, square_size)
+    image = piece_images.get(key)
+    if image is None:
+        path = "chesspieces/{}_{}.png".format(bitboard.COLOR_NAMES[piece.color][0], bitboard.PIECE_TYPES[piece.piece_type])
+        image = pygame.image.load(path).convert_alpha()
+        # Fit the sprite to the square, keeping its proportions
+        scale = square_size / max(image.get_width(), image.get_height())
+        image = pygame.transform.smoothscale(image, (round(image.get_width() * scale), round(image.get_height() * scale)))
+        piece_images[key] = image
+    return image
+
+# Function to load every sprite up front so no image is read from disk while drawing
+def load_piece_images(square_size):
+    for pieces in chess.PIECES:
+        for piece in pieces:
+            get_piece_image(piece, square_size)
+
+# Function to get a cached font
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        font = fonts[size] = pygame.font.Font('freesansbold.ttf', size)
+    return font
+
+# Function to get text rendered once and reused
+def get_label(text, size, color, background=None):
+    key = (text, size, color, background)
+    label = labels.get(key)
+    if label is None:
+        label = labels[key] = get_font(size).render(text, True, color, background)
+    return label
+
+# Function to write a (row, col) move as e2e4
+def move_name(move):
+    return bitboard.square_name(bitboard.square(*move[0])) + bitboard.square_name(bitboard.square(*move[2]))
+
+# Function to render the progress of the AI search, nothing when no search is running
+def render_progress(progress):
+    if progress is None:
+        return []
+    progress_labels = [get_label('Thinking...', 20, (255, 255, 255))]
+    if progress['depth']:
+        font = get_font(20)
+        progress_labels.append(font.render('Depth {}'.format(progress['depth']), True, (255, 255, 255)))
+        progress_labels.append(font.render('Best {}'.format(move_name(progress['move'])), True, (255, 255, 255)))
+    return progress_labels
+
+# Function to draw the rendered progress below the top of the right side
+def draw_progress(progress_labels, square_size):
+    pygame.draw.rect(screen, BACKGROUND_COLOR, [WINDOW_WIDTH - RIGHT_SPACE, 100, RIGHT_SPACE, 150], 0)
+    for n, label in enumerate(progress_labels):
+        screen.blit(label, [WINDOW_WIDTH - RIGHT_SPACE + square_size / 4, 120 + 40 * n])
+
 # Function to center the piece within the square
 def center_piece(row, col, piece_width, piece_height, square_size):
     x_offset = (square_size - piece_width) // 2
@@ -26,13 +92,12 @@ def center_piece(row, col, piece_width, piece_height, square_size):
 
 # Function to draw the chessboard and pieces
 def draw_board(board, square_size, game):
-    font = pygame.font.Font('freesansbold.ttf', 32)
     if game.is_checkmate():
-        text = font.render('Checkmate!', True, (255, 255, 255), pygame.SRCALPHA)
+        text = get_label('Checkmate!', 32, (255, 255, 255), pygame.SRCALPHA)
     elif game.is_stalemate():
-        text = font.render('Stalemate!', True, (255, 255, 255), pygame.SRCALPHA)
+        text = get_label('Stalemate!', 32, (255, 255, 255), pygame.SRCALPHA)
     else:
-        text = font.render(game.turn.capitalize() + ' to move', True, (255, 255, 255), pygame.SRCALPHA)
+        text = get_label(game.turn.capitalize() + ' to move', 32, (255, 255, 255), pygame.SRCALPHA)
     
     # create a rectangular object for the
     # text surface object
@@ -55,7 +120,7 @@ def draw_board(board, square_size, game):
 
             if board[(n, i)] is not None:
                 piece = board[(n, i)]
-                piece_img = pygame.image.load("chesspieces/{}_{}.png".format(piece.color[0], piece.piece_type)).convert_alpha()
+                piece_img = get_piece_image(piece, square_size)
                 x, y = center_piece(n, i, piece_img.get_width(), piece_img.get_height(), square_size)
                 screen.blit(piece_img, (x, y))
     
@@ -74,6 +139,7 @@ def draw_board(board, square_size, game):
 
 game = chess.ChessGame()
 square_size = (WINDOW_WIDTH - RIGHT_SPACE) // 8  # Adjust square_size to fit within the available window width
+load_piece_images(square_size)
 
 # Draw the initial board
 draw_board(game.board, square_size, game)
@@ -82,8 +148,26 @@ running = True
 piece = None
 player = 'white'
 ai_color = 'black' if player == 'white' else 'white'
-ai = ai.ChessAI(ai_color, game)
+# Static evaluation with a quiescence search at the leaves
+ai = ai.ChessAI(ai_color, game, evaluator='native')
+# Searches on a worker thread so the window keeps responding while the AI thinks
+search = background.BackgroundSearch(ai)
 mode = 0
+shown_progress = None
+progress_labels = []
+
+# Function to start a new game, stopping any search of the old one
+def new_game():
+    search.cancel()
+    new = chess.ChessGame()
+    ai.game = new
+    return new
+
+# Function to start the AI's search, unless it is already thinking or the game is over
+def start_ai_move():
+    if not search.running() and game.game_status().result is None:
+        # The board is copied since the one on screen may be replaced while the AI thinks
+        search.start(dict(game.board), ai_color, time_limit=AI_MOVE_TIME)
 
 while running:
     for event in pygame.event.get():
@@ -103,7 +187,7 @@ while running:
             row, col = game.map_coordinates_to_chessboard(x, y, square_size, TOP_SPACE, WINDOW_WIDTH, RIGHT_SPACE)
             if WINDOW_WIDTH - RIGHT_SPACE + square_size / 4 <= x <= WINDOW_WIDTH - RIGHT_SPACE + square_size / 4 + 150:
                 if 300 <= y <= 400:
-                    game = chess.ChessGame()
+                    game = new_game()
                     player = 'black' if player == 'white' else 'white'
                     draw_board(game.board, square_size, game)
                 elif 500 <= y <= 600:
@@ -111,24 +195,22 @@ while running:
                         mode = 1
                         draw_board(game.board, square_size, game)
                     else:
-                        depth = math.floor(.88 ** (game.get_piece_count(game.board) - 16) + 3)
-                        move = ai.get_best_move(game.board, ai_color, depth)
-                        game.make_move(move, game.board)
-                        draw_board(game.board, square_size, game)
+                        start_ai_move()
                 elif 700 <= y <= 800:
-                    game = chess.ChessGame()
+                    game = new_game()
                     mode = 0
                     draw_board(game.board, square_size, game)
 
         elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and piece is None:
             x, y = pygame.mouse.get_pos()
             row, col = game.map_coordinates_to_chessboard(x, y, square_size, TOP_SPACE, WINDOW_WIDTH, RIGHT_SPACE)
-            if row < 8 and row >= 0 and col < 8 and col >= 0:
+            # Pieces stay put while the AI thinks about this position
+            if row < 8 and row >= 0 and col < 8 and col >= 0 and not search.running():
                 piece = (row, col)
                 # print(ai.board_to_FEN(game.board, game.turn))
             elif WINDOW_WIDTH - RIGHT_SPACE + square_size / 4 <= x <= WINDOW_WIDTH - RIGHT_SPACE + square_size / 4 + 150:
                 if 300 <= y <= 400:   
-                    game = chess.ChessGame()
+                    game = new_game()
                     player = 'black' if player == 'white' else 'white'
                     draw_board(game.board, square_size, game)
                 elif 500 <= y <= 600:
@@ -136,12 +218,9 @@ while running:
                         mode = 1
                         draw_board(game.board, square_size, game)
                     else:
-                        depth = math.floor(.88 ** (game.get_piece_count(game.board) - 16) + 3)
-                        move = ai.get_best_move(game.board, ai_color, depth)
-                        game.make_move(move, game.board)
-                        draw_board(game.board, square_size, game)
+                        start_ai_move()
                 elif 700 <= y <= 800:
-                    game = chess.ChessGame()
+                    game = new_game()
                     mode = 0
                     draw_board(game.board, square_size, game)
 
@@ -152,17 +231,13 @@ while running:
                 move = (row, col)
                 if game.board[piece] is not None:
                     # print([piece, game.board[piece].abbr, move])
-                    if player == game.board[piece].color and game.board[piece].is_legal_move(move, game.board, game) and mode == 1:
+                    if bitboard.color_index(player) == game.board[piece].color and game.board[piece].is_legal_move(piece, move, game.board, game) and mode == 1:
                         board = game.make_move([piece, game.board[piece].abbr, move], game.board)
-                        board_state = game.convert_board_states(board)
-                        game.board_states.append(board_state)
                         game.board = board
                         screen.fill(BACKGROUND_COLOR)
                         draw_board(game.board, square_size, game)
-                    elif game.turn == game.board[piece].color and game.board[piece].is_legal_move(move, game.board, game) and mode == 0:
+                    elif bitboard.color_index(game.turn) == game.board[piece].color and game.board[piece].is_legal_move(piece, move, game.board, game) and mode == 0:
                         board = game.make_move([piece, game.board[piece].abbr, move], game.board)
-                        board_state = game.convert_board_states(board)
-                        game.board_states.append(board_state)
                         game.board = board
                         screen.fill(BACKGROUND_COLOR)
                         draw_board(game.board, square_size, game)
@@ -170,7 +245,20 @@ while running:
                 else:
                     piece = None
 
+    # Play the AI's move once its search is done, there is none if it was stopped or had no legal move
+    if search.future is not None and search.future.done():
+        move = search.future.result()
+        search.future = None
+        if move is not None:
+            game.make_move(move, game.board)
+            draw_board(game.board, square_size, game)
 
+    # Show the search depth and best move so far, rendered again only when they change
+    progress = (ai.progress or {'depth': 0}) if search.running() else None
+    if progress != shown_progress:
+        progress_labels = render_progress(progress)
+        shown_progress = progress
+    draw_progress(progress_labels, square_size)
 
     mouse_x, mouse_y = pygame.mouse.get_pos()
 
@@ -197,21 +285,21 @@ while running:
         pygame.draw.rect(screen, (255, 255, 255), [WINDOW_WIDTH - RIGHT_SPACE + square_size / 4, 700, 150, 100], 0)
 
     # Draw text on the buttons
-    font = pygame.font.Font('freesansbold.ttf', 23)
     not_player = 'black' if player == 'white' else 'white'
-    text = font.render('Play as ' + not_player, True, (0, 0, 0))
+    text = get_label('Play as ' + not_player, 23, (0, 0, 0))
     screen.blit(text, [WINDOW_WIDTH - RIGHT_SPACE + square_size / 4, 330])
 
     if mode == 0:
-        text = font.render('Verse AI', True, (0, 0, 0))
+        text = get_label('Verse AI', 23, (0, 0, 0))
         screen.blit(text, [WINDOW_WIDTH - RIGHT_SPACE + square_size / 2, 530])
     elif mode == 1:
-        text = font.render('AI move', True, (0, 0, 0))
+        text = get_label('AI move', 23, (0, 0, 0))
         screen.blit(text, [WINDOW_WIDTH - RIGHT_SPACE + square_size / 2, 530])
 
-    text = font.render('Reset', True, (0, 0, 0))
+    text = get_label('Reset', 23, (0, 0, 0))
     screen.blit(text, [WINDOW_WIDTH - RIGHT_SPACE + square_size / 2 + 10, 730])
 
     pygame.display.update()
 
+search.close()
 pygame.quit()
@@ -0,0 +1,119 @@
+"""
+Move ordering for the alpha-beta search
+
+Moves are searched in the order: hash move, captures by MVV-LVA (most
+valuable victim, then least valuable attacker), killer moves of the ply,
+then the remaining quiet moves by history score. staged_moves generates
+them in that order one stage at a time. Killers and history are
+kept for one search, in flat tables indexed by ply and by
+(side to move, from, to). A seeded ordering starts every search with small
+random history scores, so Lazy SMP helpers order quiet moves differently.
+"""
+
+import random
+from array import array
+
+import bitboard
+
+HASH_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 24
+KILLER_SCORE = 1 << 20
+# History scores are halved before they reach the killers
+HISTORY_MAX = KILLER_SCORE - 1
+KILLERS_PER_PLY = 2
+# Largest starting history score of a seeded ordering
+HISTORY_NOISE = 32
+
+
+class MoveOrdering():
+
+    def __init__(self, max_ply=128, seed=None):
+        self.max_ply = max_ply
+        self.seed = seed
+        self.clear()
+
+    def clear(self):
+        # Two killer slots per ply, 0 is never a real move
+        self.killers = array('I', bytes(4 * KILLERS_PER_PLY * self.max_ply))
+        # One counter per side to move and from, to squares
+        if self.seed is None:
+            self.history = array('i', bytes(4 * 2 * 4096))
+        else:
+            rng = random.Random(self.seed)
+            self.history = array('i', (rng.randrange(HISTORY_NOISE) for i in range(2 * 4096)))
+
+    def is_quiet(self, position, move):
+        # Neither a capture, an en passant capture nor a promotion
+        to_sq = (move >> 6) & 63
+        if position.mailbox[to_sq] is not None or move >> 12:
+            return False
+        return not (to_sq == position.ep_square and position.mailbox[move & 63][1] == bitboard.PAWN)
+
+    def score(self, position, move, hash_move, ply):
+        if move == hash_move:
+            return HASH_SCORE
+        from_sq = move & 63
+        to_sq = (move >> 6) & 63
+        victim = position.mailbox[to_sq]
+        promotion = move >> 12
+        if victim is not None or promotion:
+            attacker = position.mailbox[from_sq][1]
+            value = bitboard.PIECE_VALUES[victim[1]] if victim is not None else 0
+            if promotion:
+                value += bitboard.PIECE_VALUES[promotion]
+            return CAPTURE_SCORE + value * 8 - attacker
+        if to_sq == position.ep_square and position.mailbox[from_sq][1] == bitboard.PAWN:
+            return CAPTURE_SCORE + bitboard.PIECE_VALUES[bitboard.PAWN] * 8
+        if ply < self.max_ply:
+            slot = ply * KILLERS_PER_PLY
+            if move == self.killers[slot]:
+                return KILLER_SCORE + 1
+            if move == self.killers[slot + 1]:
+                return KILLER_SCORE
+        return self.history[(position.turn << 12) | (move & 0xfff)]
+
+    def order(self, position, moves, hash_move=None, ply=0):
+        """
+        Sort moves in place, best first, and return them
+        """
+
+        moves.sort(key=lambda move: self.score(position, move, hash_move, ply), reverse=True)
+        return moves
+
+    def staged_moves(self, position, hash_move=None, ply=0):
+        """
+        Yield pseudo legal moves a stage at a time: the hash move, captures and promotions
+        by MVV-LVA, then quiet moves with the killers first and the rest by history.
+        A stage is only generated once the one before it is used up, and legality is
+        left to the caller.
+        """
+
+        if hash_move is not None and position.is_pseudo_legal(hash_move):
+            yield hash_move
+        else:
+            hash_move = None
+
+        for moves in (position.capture_moves, position.quiet_moves):
+            for move in self.order(position, moves(), None, ply):
+                if move != hash_move:
+                    yield move
+
+    def update(self, position, move, ply, depth):
+        """
+        Record a quiet move that caused a cutoff at ply with depth plies left
+        position is the node the move was played from
+        """
+
+        if not self.is_quiet(position, move):
+            return
+        if ply < self.max_ply:
+            slot = ply * KILLERS_PER_PLY
+            if self.killers[slot] != move:
+                self.killers[slot + 1] = self.killers[slot]
+                self.killers[slot] = move
+
+        index = (position.turn << 12) | (move & 0xfff)
+        self.history[index] += depth * depth
+        if self.history[index] > HISTORY_MAX:
+            for i in range(len(self.history)):
+                self.history[i] >>= 1
@@ -0,0 +1,116 @@
+"""
+Root-parallel search
+
+RootSearchPool fans the root moves of one iteration out to a
+ProcessPoolExecutor. Each worker keeps its own ChessAI, and with it its own
+transposition table, for the life of the pool. Tasks carry the position as
+a FEN string with its repetition counts and the move as a packed int, and every worker reads and raises
+one shared alpha bound, so moves searched after a good one still get
+cutoffs. A worker reads the bound again before each reply to its move, so
+it gains from moves that finish while it is still searching. A move that
+fails low against that bound only has an upper bound for a score, which
+may tie the best score, so each result says whether it raised the bound. The first move is searched alone to set that bound before the rest
+are sent out.
+"""
+
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ai
+import bitboard
+import chess_game
+import search_stats
+
+# Set in each worker process by _init_worker
+_ai = None
+_alpha = None
+
+
+def _init_worker(alpha, options):
+    global _ai, _alpha
+    _alpha = alpha
+    _ai = ai.ChessAI('white', chess_game.ChessGame(), **options)
+    _ai.shared_alpha = alpha
+    _ai.root_fen = None
+
+
+def search_move(fen, key_counts, move, color, max_depth, deadline=None, node_limit=None):
+    """
+    Search one root move of the position in fen to max_depth in a worker
+    key_counts is the root's repetition counts, which the FEN cannot carry
+    deadline is a time.time() value, since tasks may wait in the queue before they start
+    Returns {'move', 'score', 'exact', 'time', 'nodes', 'stopped', 'stats'}, stats as a SearchStats.to_dict
+    record and exact set when the score raised the shared alpha, so it is the move's true score
+    """
+
+    tic = time.perf_counter()
+    position = bitboard.Position.from_fen(fen)
+    position.key_counts = dict(key_counts)
+    if fen != _ai.root_fen:
+        # A new search, the killers and history of the last one do not apply
+        _ai.ordering.clear()
+        _ai.root_fen = fen
+    if color != _ai.tt_color:
+        _ai.tt.clear()
+        _ai.tt_color = color
+    _ai.max_depth = max_depth
+    _ai.nodes = 0
+    _ai.stopped = False
+    _ai.deadline = None if deadline is None else tic + deadline - time.time()
+    _ai.node_limit = node_limit
+    _ai.stats = search_stats.SearchStats()
+
+    score = _ai.search_root_move(position, color, move, _alpha.value, math.inf)
+    _ai.stats.nodes = _ai.nodes
+    # Above every alpha the search used, the score is exact, otherwise only an upper bound
+    exact = False
+    if not _ai.stopped:
+        with _alpha.get_lock():
+            if score > _alpha.value:
+                _alpha.value = score
+                exact = True
+
+    return {
+        'move': move,
+        'score': score,
+        'exact': exact,
+        'time': time.perf_counter() - tic,
+        'nodes': _ai.nodes,
+        'stopped': _ai.stopped,
+        'stats': _ai.stats.to_dict()
+    }
+
+
+class RootSearchPool():
+
+    def __init__(self, workers, options):
+        self.workers = workers
+        self.alpha = multiprocessing.Value('d', -math.inf)
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.alpha, options))
+
+    def search(self, position, color, moves, max_depth, time_limit=None, node_limit=None):
+        """
+        Search every move at the root of position and return one result dict per move,
+        in the order of moves. A result with 'stopped' set ran out of budget.
+        node_limit is split evenly between the moves.
+        """
+
+        fen = position.fen()
+        deadline = None if time_limit is None else time.time() + time_limit
+        if node_limit is not None:
+            node_limit = max(node_limit // len(moves), 1)
+        with self.alpha.get_lock():
+            self.alpha.value = -math.inf
+
+        first = self.executor.submit(search_move, fen, position.key_counts, moves[0], color, max_depth, deadline, node_limit).result()
+        if first['stopped']:
+            return [first]
+
+        futures = [self.executor.submit(search_move, fen, position.key_counts, move, color, max_depth, deadline, node_limit)
+                   for move in moves[1:]]
+        return [first] + [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,208 @@
+"""
+Perft benchmark for the move generator
+
+Counts the leaf nodes of the legal move tree to a given depth and reports
+nodes per second. By default the bitboard Position the search runs on is
+counted. --game counts ChessGame's board dictionary instead, with the
+pieces' generate_moves and is_legal_move and ChessGame.make_move, the path
+the UI checks human moves with. Run as a module:
+
+    python -m perft 4
+    python -m perft 3 --position kiwipete --divide
+    python -m perft 5 --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"
+    python -m perft 4 --suite
+    python -m perft 3 --suite --game
+"""
+
+import argparse
+import sys
+import time
+
+import bitboard
+import chess_game
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Standard reference positions with their known node counts from depth 1 upwards
+REFERENCE_POSITIONS = {
+    'start': (START_FEN, [20, 400, 8902, 197281, 4865609, 119060324]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 [48, 2039, 97862, 4085603, 193690690]),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                  [14, 191, 2812, 43238, 674624, 11030083]),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333, 15833292]),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                  [44, 1486, 62379, 2103487, 89941194]),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  [46, 2079, 89890, 3894594, 164075551]),
+    # En passant only from an adjacent file, the b4 pawn may take a2-a4 and the h4 pawn may not
+    'en_passant': ('4k3/8/8/8/1p5p/8/P7/4K3 w - - 0 1', [7, 51, 397, 3384, 27100]),
+}
+
+# Pieces a pawn can promote to, as ChessGame.make_move takes them
+PROMOTIONS = ('Q', 'R', 'B', 'H')
+
+
+def perft(position, depth):
+    """
+    Count the leaf nodes of the legal move tree depth plies below position
+    """
+
+    if depth == 0:
+        return 1
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def divide(position, depth):
+    # Node count below each root move, keyed by the move in UCI notation
+    counts = {}
+    for move in position.legal_moves():
+        position.make_move(move)
+        counts[bitboard.move_to_uci(move)] = perft(position, depth - 1) if depth > 1 else 1
+        position.unmake_move()
+    return counts
+
+
+def game_moves(game):
+    """
+    Legal moves of the side to move on a ChessGame's board, in its [from, abbr, to] form
+    A pawn reaching the last rank gives one move per promotion piece
+    """
+
+    turn = bitboard.color_index(game.turn)
+    moves = []
+    for square, piece in list(game.board.items()):
+        if piece is None or piece.color != turn:
+            continue
+        for target in piece.generate_moves(square, game.board, game):
+            if not piece.is_legal_move(square, target, game.board, game):
+                continue
+            if piece.piece_type == bitboard.PAWN and target[0] in (0, 7):
+                moves.extend([square, piece.abbr, target, promotion] for promotion in PROMOTIONS)
+            else:
+                moves.append([square, piece.abbr, target])
+    return moves
+
+
+def game_move_to_uci(move):
+    name = bitboard.square_name(bitboard.square(*move[0])) + bitboard.square_name(bitboard.square(*move[2]))
+    if len(move) > 3:
+        name += bitboard.FEN_LETTERS[bitboard.PIECE_ABBRS.index(move[3])].lower()
+    return name
+
+
+def game_perft(game, depth):
+    """
+    Count the leaf nodes of the legal move tree depth plies below a ChessGame's position
+    """
+
+    if depth == 0:
+        return 1
+    moves = game_moves(game)
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        game.make_move(move, game.board)
+        nodes += game_perft(game, depth - 1)
+        game.unmake_move(game.board)
+    return nodes
+
+
+def game_divide(game, depth):
+    # Node count below each root move of a ChessGame, keyed by the move in UCI notation
+    counts = {}
+    for move in game_moves(game):
+        game.make_move(move, game.board)
+        counts[game_move_to_uci(move)] = game_perft(game, depth - 1) if depth > 1 else 1
+        game.unmake_move(game.board)
+    return counts
+
+
+def run(fen, depth, show_divide=False, out=sys.stdout, game=False):
+    """
+    Run perft on a FEN and print nodes, time and nodes per second
+    game counts ChessGame's board dictionary instead of a bitboard Position
+    Returns the node count
+    """
+
+    if game:
+        position = chess_game.ChessGame.from_fen(fen)
+        count, split = game_perft, game_divide
+    else:
+        position = bitboard.Position.from_fen(fen)
+        count, split = perft, divide
+    tic = time.perf_counter()
+    if show_divide:
+        counts = split(position, depth)
+        for name in sorted(counts):
+            print(f"{name}: {counts[name]}", file=out)
+        nodes = sum(counts.values())
+    else:
+        nodes = count(position, depth)
+    toc = time.perf_counter()
+
+    elapsed = toc - tic
+    nps = nodes / elapsed if elapsed > 0 else 0
+    print(f"depth {depth}: {nodes} nodes in {elapsed:0.4f} seconds ({nps:0.0f} nodes/sec)", file=out)
+    return nodes
+
+
+def run_suite(max_depth, out=sys.stdout, game=False):
+    """
+    Check every reference position up to max_depth against its expected counts
+    Returns True if all counts match
+    """
+
+    passed = True
+    for name, (fen, expected) in REFERENCE_POSITIONS.items():
+        print(f"{name}: {fen}", file=out)
+        for depth in range(1, min(max_depth, len(expected)) + 1):
+            nodes = run(fen, depth, out=out, game=game)
+            if nodes != expected[depth - 1]:
+                print(f"  MISMATCH, expected {expected[depth - 1]}", file=out)
+                passed = False
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m perft', description="Count move generator leaf nodes to a depth.")
+    parser.add_argument('depth', type=int, nargs='?', default=3)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--fen', help="position to search, default is the start position")
+    source.add_argument('--position', choices=sorted(REFERENCE_POSITIONS), help="reference position to search")
+    source.add_argument('--suite', action='store_true', help="check every reference position up to depth")
+    parser.add_argument('--divide', action='store_true', help="print the node count below each root move")
+    parser.add_argument('--game', action='store_true', help="count ChessGame's board dictionary instead of a bitboard Position")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.depth, game=args.game) else 1
+
+    if args.position:
+        fen, expected = REFERENCE_POSITIONS[args.position]
+    else:
+        fen, expected = args.fen or START_FEN, None
+        if fen == START_FEN:
+            expected = REFERENCE_POSITIONS['start'][1]
+
+    nodes = run(fen, args.depth, args.divide, game=args.game)
+    if expected is not None and args.depth <= len(expected) and nodes != expected[args.depth - 1]:
+        print(f"MISMATCH, expected {expected[args.depth - 1]}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Profiling a single search
+
+profile_call runs a function, normally ChessAI.get_best_move, under one of
+two profilers and writes what it finds next to a path prefix:
+
+    'cprofile'  cProfile, with exact call counts and times, written to
+                <path>.pstats. A stack sampler runs alongside it for the
+                flamegraph, since cProfile only keeps caller/callee pairs.
+    'sample'    only the stack sampler, which looks at the searching
+                thread every interval and costs far less. Its <path>.pstats
+                counts samples instead of calls.
+
+Both write <path>.collapsed, one "frame;frame;frame count" line per stack
+in the collapsed format flamegraph.pl and speedscope read. Frames are named
+module.function, so time is attributed to chess_game, bitboard and ai
+functions. Run as a module to profile one search of a position:
+
+    python -m profiling --depth 4
+    python -m profiling --fen "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3" --time 5 --mode sample
+"""
+
+import argparse
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ('cprofile', 'sample')
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.001
+# Functions reported on their own, by file and name
+WATCHED_FILES = ('chess_game.py', 'ai.py', 'bitboard.py')
+WATCHED_FUNCTIONS = ('make_move', 'unmake_move', 'generate_moves', 'is_legal_move', 'is_check', 'is_checkmate',
+                     'game_status', 'legal_moves', 'evaluate_board', 'board_to_FEN', 'minValue', 'maxValue', 'quiesce')
+
+
+def frame_name(code):
+    # module.qualified_name of a code object
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return '{}.{}'.format(module, getattr(code, 'co_qualname', code.co_name))
+
+
+class StackSampler():
+    """
+    Sample the stack of one thread from a background thread
+    Stacks are kept from the frame running root_code down, when it is on the stack
+    """
+
+    def __init__(self, thread_id, root_code=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.root_code = root_code
+        self.interval = interval
+        # Stacks of code objects, outermost first, and how often each was seen
+        self.samples = Counter()
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(code)
+                if code is self.root_code:
+                    break
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.samples[tuple(stack)] += 1
+
+    def start(self):
+        # A shorter switch interval lets the sampler in while the search holds the GIL
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval))
+        self.tic = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.tic
+        sys.setswitchinterval(self.switch_interval)
+
+    def collapsed(self):
+        # Lines of the collapsed stack format, heaviest stack first
+        lines = Counter()
+        for stack, count in self.samples.items():
+            lines[';'.join(frame_name(code) for code in stack)] += count
+        return ['{} {}'.format(stack, count) for stack, count in lines.most_common()]
+
+    def pstats_data(self):
+        """
+        The samples in the marshalled dictionary format pstats reads, with sample counts
+        for call counts and the time each sample stands for spread over its stack
+        """
+
+        total = sum(self.samples.values())
+        per_sample = self.elapsed / total if total else 0.0
+        stats = {}
+        for stack, count in self.samples.items():
+            seconds = count * per_sample
+            keys = [(code.co_filename, code.co_firstlineno, code.co_name) for code in stack]
+            seen = set()
+            for i, key in enumerate(keys):
+                calls, _, own, inclusive, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                leaf = i == len(keys) - 1
+                if leaf:
+                    own += seconds
+                # A recursive function counts once per stack for inclusive time
+                if key not in seen:
+                    inclusive += seconds
+                    calls += count
+                    seen.add(key)
+                    if i:
+                        caller = callers.get(keys[i - 1], (0, 0, 0.0, 0.0))
+                        callers[keys[i - 1]] = (caller[0] + count, caller[1] + count,
+                                                caller[2] + (seconds if leaf else 0.0), caller[3] + seconds)
+                stats[key] = (calls, calls, own, inclusive, callers)
+        return stats
+
+
+def profile_call(func, args=(), kwargs=None, mode='cprofile', path='search', interval=SAMPLE_INTERVAL):
+    """
+    Run func(*args, **kwargs) under the profiler named by mode and return its result
+    Writes <path>.pstats and <path>.collapsed
+    """
+
+    if mode not in MODES:
+        raise ValueError("Unknown profiler {!r}, expected one of {}".format(mode, ', '.join(MODES)))
+    if kwargs is None:
+        kwargs = {}
+
+    root_code = getattr(func, '__func__', func).__code__
+    sampler = StackSampler(threading.get_ident(), root_code, interval)
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    sampler.start()
+    try:
+        if profiler is not None:
+            result = profiler.runcall(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+    finally:
+        sampler.stop()
+
+    if profiler is not None:
+        profiler.dump_stats(path + '.pstats')
+    else:
+        with open(path + '.pstats', 'wb') as stats_file:
+            marshal.dump(sampler.pstats_data(), stats_file)
+    with open(path + '.collapsed', 'w') as collapsed_file:
+        for line in sampler.collapsed():
+            collapsed_file.write(line + '\n')
+    return result
+
+
+def report(path, limit=25, out=sys.stdout):
+    """
+    Print the watched chess_game, bitboard and ai functions, then the heaviest functions
+    of the engine's own modules by cumulative time, from <path>.pstats
+    """
+
+    stats = pstats.Stats(path + '.pstats', stream=io.StringIO())
+    print(f"{'function':<40}{'calls':>10}{'own s':>10}{'total s':>10}", file=out)
+    rows = []
+    for (filename, line, name), (_, calls, own, inclusive, callers) in stats.stats.items():
+        if os.path.basename(filename) in WATCHED_FILES and name in WATCHED_FUNCTIONS:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            rows.append((inclusive, '{}.{}'.format(module, name), calls, own))
+    for inclusive, name, calls, own in sorted(rows, reverse=True):
+        print(f"{name:<40}{calls:>10}{own:>10.3f}{inclusive:>10.3f}", file=out)
+    print(file=out)
+
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(r'(chess_game|ai|bitboard|evaluation|ordering|transposition)\.py', limit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m profiling', description="Profile one ChessAI search.")
+    parser.add_argument('--fen', help="position to search, default is the start position")
+    parser.add_argument('--depth', type=int, help="search depth, default the AI's max_depth without a time")
+    parser.add_argument('--time', type=float, help="seconds to search")
+    parser.add_argument('--evaluator', default='native', choices=('native', 'stockfish'))
+    parser.add_argument('--book', action='store_true', help="play from the opening book when the position is in it")
+    parser.add_argument('--mode', default='cprofile', choices=MODES, help="profiler to run the search under")
+    parser.add_argument('--interval', type=float, default=SAMPLE_INTERVAL, help="seconds between stack samples")
+    parser.add_argument('--out', default='search', help="path prefix of the .pstats and .collapsed files")
+    parser.add_argument('--limit', type=int, default=25, help="functions listed by cumulative time")
+    args = parser.parse_args(argv)
+
+    # Imported here so the profiler itself does not depend on the engine
+    import ai
+    import chess_game
+
+    game = chess_game.ChessGame.from_fen(args.fen) if args.fen else chess_game.ChessGame()
+    player = ai.ChessAI(game.turn, game, evaluator=args.evaluator)
+    if not args.book and player.book is not None:
+        player.book.close()
+        player.book = None
+    try:
+        move = player.get_best_move(game.board, game.turn, args.depth, args.time, profile=args.mode,
+                                    profile_path=args.out, profile_interval=args.interval)
+    finally:
+        player.close()
+
+    print(f"best move {move}, {player.stats.nodes} nodes in {player.stats.time:.3f} seconds")
+    print(f"wrote {args.out}.pstats and {args.out}.collapsed")
+    print()
+    report(args.out, args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Search statistics
+
+ChessAI fills in a SearchStats for every search and keeps it as
+ChessAI.stats: nodes, leaf evaluations, engine calls and their latency,
+cutoffs by the index of the move that caused them, transposition table
+hits, the deepest ply reached, the branching factor and the time spent
+generating moves and evaluating. Counters are plain attributes the search
+adds to in place. to_dict gives a JSON-ready record, and a JsonLinesSink
+writes one record per line to a file or stream.
+"""
+
+import json
+import math
+import sys
+
+import bitboard
+
+# Cutoffs are counted by move index up to this, later ones share the last slot
+MAX_CUTOFF_INDEX = 64
+
+
+def json_score(score):
+    # JSON has no infinity, a mate score is written as a string
+    if score is None or math.isfinite(score):
+        return score
+    return 'inf' if score > 0 else '-inf'
+
+
+class SearchStats():
+
+    def __init__(self):
+        # 'search', 'book' and 'forced' for moves played without one, or 'game over' without a legal move
+        self.source = 'search'
+        self.move = None
+        self.score = None
+        self.depth = 0
+        self.time = 0.0
+        # Nodes of this process, and of the Lazy SMP helpers
+        self.nodes = 0
+        self.helper_nodes = 0
+        self.leaf_evals = 0
+        self.eval_time = 0.0
+        self.engine_calls = 0
+        self.engine_time = 0.0
+        self.eval_cache_hits = 0
+        self.eval_cache_misses = 0
+        self.movegen_time = 0.0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # Probes whose stored score settled the node
+        self.tt_cutoffs = 0
+        self.cutoffs = [0] * MAX_CUTOFF_INDEX
+        # Deepest ply reached, quiescence included
+        self.max_depth = 0
+        # Nodes whose moves were searched, and the moves searched from them
+        self.expanded_nodes = 0
+        self.moves_searched = 0
+        # One {'depth', 'move', 'score', 'nodes', 'time'} per completed iteration
+        self.iterations = []
+
+    def add_cutoff(self, index):
+        self.cutoffs[min(index, MAX_CUTOFF_INDEX - 1)] += 1
+
+    def branching_factor(self):
+        # Moves searched per node that searched its moves
+        return self.moves_searched / self.expanded_nodes if self.expanded_nodes else 0.0
+
+    def effective_branching_factor(self):
+        # Growth of the node count from one iteration to the next
+        if len(self.iterations) < 2 or not self.iterations[-2]['nodes']:
+            return None
+        return self.iterations[-1]['nodes'] / self.iterations[-2]['nodes']
+
+    def merge(self, record):
+        """
+        Add the counters of a to_dict record from a worker's search of part of the tree
+        """
+
+        for name in ('nodes', 'leaf_evals', 'eval_time', 'engine_calls', 'engine_time', 'eval_cache_hits',
+                     'eval_cache_misses', 'movegen_time', 'tt_probes', 'tt_hits', 'tt_cutoffs',
+                     'expanded_nodes', 'moves_searched'):
+            setattr(self, name, getattr(self, name) + record[name])
+        for index, count in enumerate(record['cutoffs']):
+            self.cutoffs[index] += count
+        self.max_depth = max(self.max_depth, record['max_depth'])
+
+    def to_dict(self):
+        # Trailing move indexes without cutoffs are left out
+        cutoffs = list(self.cutoffs)
+        while cutoffs and not cutoffs[-1]:
+            cutoffs.pop()
+        total_nodes = self.nodes + self.helper_nodes
+        return {
+            'source': self.source,
+            'move': None if self.move is None else bitboard.move_to_uci(self.move),
+            'score': json_score(self.score),
+            'depth': self.depth,
+            'time': self.time,
+            'nodes': self.nodes,
+            'helper_nodes': self.helper_nodes,
+            'nodes_per_second': total_nodes / self.time if self.time else 0.0,
+            'leaf_evals': self.leaf_evals,
+            'eval_time': self.eval_time,
+            'engine_calls': self.engine_calls,
+            'engine_time': self.engine_time,
+            'engine_latency': self.engine_time / self.engine_calls if self.engine_calls else 0.0,
+            'eval_cache_hits': self.eval_cache_hits,
+            'eval_cache_misses': self.eval_cache_misses,
+            'movegen_time': self.movegen_time,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_cutoffs': self.tt_cutoffs,
+            'cutoffs': cutoffs,
+            'max_depth': self.max_depth,
+            'expanded_nodes': self.expanded_nodes,
+            'moves_searched': self.moves_searched,
+            'branching_factor': self.branching_factor(),
+            'effective_branching_factor': self.effective_branching_factor(),
+            'iterations': [dict(iteration, move=bitboard.move_to_uci(iteration['move']), score=json_score(iteration['score']))
+                           for iteration in self.iterations]
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+class JsonLinesSink():
+    """
+    Write records as JSON lines to a file path (appended to), an open stream,
+    or '-' for standard error
+    """
+
+    def __init__(self, target):
+        self.owned = isinstance(target, str) and target != '-'
+        if target == '-':
+            self.stream = sys.stderr
+        elif self.owned:
+            self.stream = open(target, 'a')
+        else:
+            self.stream = target
+
+    def emit(self, record):
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+
+
+def make_sink(target):
+    # None, a sink with an emit method, or anything JsonLinesSink accepts
+    if target is None or hasattr(target, 'emit'):
+        return target
+    return JsonLinesSink(target)
@@ -0,0 +1,80 @@
+"""
+Lazy SMP helpers
+
+SmpPool runs helper processes that search the same position as the main
+search and share its transposition table through shared memory. Each
+helper searches differently from the main search and from the others, so
+they fill the table with results the main search picks up as hash hits
+and hash moves: odd helpers start one ply ahead and go one ply deeper, and
+every helper seeds its move ordering with its index, which shuffles its
+first root move order and its quiet moves. Their own best moves are
+thrown away. The main search
+sets a shared flag when it is done and the helpers stop at their next node.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ai
+import bitboard
+import chess_game
+import transposition
+
+# Set in each helper process by _init_worker
+_ai = None
+
+
+def _init_worker(stop_flag, tt_name, tt_size, options):
+    global _ai
+    _ai = ai.ChessAI('white', chess_game.ChessGame(), **options)
+    _ai.tt = transposition.SharedTranspositionTable(tt_size, tt_name)
+    _ai.stop_flag = stop_flag
+
+
+def helper_search(fen, key_counts, color, depth, helper, deadline=None):
+    """
+    Search the position in fen until the stop flag is set, the deadline (a time.time()
+    value) passes or depth is reached. Returns the number of nodes searched.
+    """
+
+    position = bitboard.Position.from_fen(fen)
+    position.key_counts = dict(key_counts)
+    # The main search already cleared the table for color
+    _ai.tt_color = color
+    _ai.ordering.seed = helper
+    time_limit = None if deadline is None else max(deadline - time.time(), 0)
+    _ai.search(position, color, min(depth + helper % 2, ai.MAX_DEPTH), time_limit, start_depth=helper % 2)
+    return _ai.nodes
+
+
+class SmpPool():
+
+    def __init__(self, helpers, tt, options):
+        self.helpers = helpers
+        self.stop_flag = multiprocessing.RawValue('b', 0)
+        self.executor = ProcessPoolExecutor(helpers, initializer=_init_worker,
+                                            initargs=(self.stop_flag, tt.name, tt.size, options))
+        self.futures = []
+
+    def start(self, position, color, depth, time_limit=None):
+        # Start every helper on the position
+        fen = position.fen()
+        deadline = None if time_limit is None else time.time() + time_limit
+        self.stop_flag.value = 0
+        self.futures = [self.executor.submit(helper_search, fen, position.key_counts, color, depth, helper, deadline)
+                        for helper in range(1, self.helpers + 1)]
+
+    def stop(self):
+        """
+        Stop the helpers and wait for them, returns the nodes they searched
+        """
+
+        self.stop_flag.value = 1
+        nodes = sum(future.result() for future in self.futures)
+        self.futures = []
+        return nodes
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown()
@@ -0,0 +1,121 @@
+"""
+Fixed size transposition table for the alpha-beta search
+
+Entries are indexed by the low bits of a position's Zobrist key and hold
+(key, depth, bound, score, best move). Depth is the number of plies that
+were searched below the position.
+
+SharedTranspositionTable has the same interface but keeps its entries in
+multiprocessing.shared_memory so several search processes can use one
+table. Entries are written without locks: each slot holds the key XORed
+with the packed data and the data itself, and a probe only accepts a slot
+whose two words agree, so a slot torn by two concurrent writers reads as
+a miss rather than a wrong score.
+"""
+
+import struct
+from multiprocessing import shared_memory
+
+# Bound types of a stored score
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionTable():
+
+    def __init__(self, size=1 << 20):
+        # Round the size down to a power of two so the index is a mask
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.size = size
+        self.mask = size - 1
+        self.entries = [None] * size
+
+    def probe(self, key):
+        """
+        Return the (key, depth, bound, score, move) entry for key, or None
+        """
+
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        # Keep a deeper result for the same position, otherwise replace
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] != key or depth >= entry[1]:
+            self.entries[index] = (key, depth, bound, score, move)
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+
+FLOAT = struct.Struct('<f')
+
+
+def pack_data(depth, bound, score, move):
+    # score as a float32 in bits 0-31, move in 32-47 (0 for none), bound in 48-49, depth in 50-57,
+    # and bit 58 set so a used slot is never all zero
+    score_bits = int.from_bytes(FLOAT.pack(score), 'little')
+    return score_bits | (move or 0) << 32 | bound << 48 | min(depth, 255) << 50 | 1 << 58
+
+
+def unpack_data(data):
+    score = FLOAT.unpack((data & 0xffffffff).to_bytes(4, 'little'))[0]
+    move = (data >> 32) & 0xffff
+    return (data >> 50) & 0xff, (data >> 48) & 3, score, move or None
+
+
+class SharedTranspositionTable():
+
+    def __init__(self, size=1 << 20, name=None):
+        """
+        Create a table of size entries, or attach to the existing block called name
+        """
+
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.size = size
+        self.mask = size - 1
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=16 * size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        # Two uint64 words per entry, key ^ data then data
+        self.words = self.memory.buf.cast('Q')
+        if self.owner:
+            self.clear()
+
+    def probe(self, key):
+        """
+        Return the (key, depth, bound, score, move) entry for key, or None
+        """
+
+        index = (key & self.mask) << 1
+        data = self.words[index + 1]
+        if self.words[index] ^ data != key or not data:
+            return None
+        return (key,) + unpack_data(data)
+
+    def store(self, key, depth, bound, score, move):
+        # Keep a deeper result for the same position, otherwise replace
+        index = (key & self.mask) << 1
+        old = self.words[index + 1]
+        if old and self.words[index] ^ old == key and depth < (old >> 50) & 0xff:
+            return
+        data = pack_data(depth, bound, score, move)
+        self.words[index] = key ^ data
+        self.words[index + 1] = data
+
+    def clear(self):
+        self.memory.buf[:] = bytes(16 * self.size)
+
+    def close(self):
+        # Detach, and free the block if this table created it
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()